@@ -1,16 +1,42 @@
 import os
+
+# GEVENT=1 serves `python app.py` from a gevent WSGI server so long-lived SSE streams cost a greenlet instead of a
+# thread. Patching has to happen before anything else imports socket/threading.
+GEVENT_ENABLED = os.environ.get('GEVENT') == '1'
+if GEVENT_ENABLED:
+    from gevent import monkey
+
+    monkey.patch_all()
+
+import functools
+import hashlib
+import io
+import itertools
 import logging
 import json
-import io
 import re
+import sqlite3
 import sys
-from datetime import datetime, timedelta
-from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from cachetools import TTLCache
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash, \
+    stream_with_context, has_request_context
 from dotenv import load_dotenv
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from PIL import Image
-from flask_migrate import Migrate
+from flask_migrate import Migrate, upgrade as upgrade_database
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event, func, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 # Import models first
 from models import db, User, Conversation, Message, UserProfile, UserMemory, TaskAutomation, EmotionLog, ProactiveTask
@@ -22,6 +48,12 @@ app = Flask(__name__)
 # Enhanced session configuration for Railway deployment
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'a-very-secret-key-for-production')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
+# validate_session compares epoch seconds against this on every request
+SESSION_TTL_SECONDS = app.config['PERMANENT_SESSION_LIFETIME'].total_seconds()
+# The session cookie is only re-signed when it changes; last_activity changes at most once a minute, which also keeps
+# the cookie's expiry sliding
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+SESSION_ACTIVITY_WRITE_INTERVAL = 60
 
 # Railway-specific session configuration
 if os.environ.get('RAILWAY_ENVIRONMENT'):
@@ -35,6 +67,71 @@ app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
 logging.basicConfig(level=logging.INFO)
 
+# Compiled templates are shared through a bytecode cache so freshly spawned workers skip parsing them again
+JINJA_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'alexai-jinja')
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+# Static URLs carry a content hash (see static_url_version), so browsers and CDNs can keep the files for a year
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 31536000
+
+
+@functools.cache
+def static_file_version(filename):
+    """Short content hash of a static file, computed once per process"""
+    try:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            return hashlib.blake2b(f.read(), digest_size=6).hexdigest()
+    except OSError:
+        return None
+
+
+@app.url_defaults
+def static_url_version(endpoint, values):
+    """Append ?v=<hash> to url_for('static', ...) so a deploy that changes a file also changes its URL"""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        # In debug the hash is recomputed so edited files get a fresh URL without a restart
+        lookup = static_file_version.__wrapped__ if app.debug else static_file_version
+        version = lookup(values['filename'])
+        if version:
+            values['v'] = version
+
+# Compress HTML, JSON and static responses; text/event-stream is not in the mimetype list, so /chat streams untouched
+try:
+    from flask_compress import Compress
+
+    app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+    app.config['COMPRESS_MIN_SIZE'] = 1024
+    Compress(app)
+except ImportError:
+    logging.warning("flask-compress not installed, responses will not be compressed")
+
+# With Redis configured, sessions live server-side and the cookie only carries the session id, so requests skip
+# verifying and re-signing the full session payload
+if os.environ.get('REDIS_URL'):
+    try:
+        import redis
+        from flask_session import Session
+
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.Redis.from_url(os.environ['REDIS_URL'])
+        app.config['SESSION_KEY_PREFIX'] = 'alexai:session:'
+        Session(app)
+
+        # Static assets and health probes never use the session, so they skip the Redis read that opens it; a
+        # null session is also never saved
+        SESSIONLESS_PATH_PREFIXES = (app.static_url_path + '/', '/health', '/favicon.ico')
+        open_server_session = app.session_interface.open_session
+
+        def open_session_unless_sessionless(app, request):
+            if request.path.startswith(SESSIONLESS_PATH_PREFIXES):
+                return app.session_interface.make_null_session(app)
+            return open_server_session(app, request)
+
+        app.session_interface.open_session = open_session_unless_sessionless
+    except ImportError:
+        logging.warning("Flask-Session not installed, sessions stay in signed cookies")
+
 
 # --- Environment Detection ---
 def get_environment():
@@ -130,6 +227,23 @@ def validate_password(password):
 
 
 
+def find_user_by_username(username):
+    """Look up a user by username through the unique index on the column"""
+    return db.session.execute(db.select(User).where(User.username == username)).scalar_one_or_none()
+
+
+def username_exists(username):
+    """Existence check that only reads the id instead of loading the whole user row"""
+    return db.session.execute(db.select(User.id).where(User.username == username).limit(1)).first() is not None
+
+
+USERNAME_TAKEN_ERROR = {
+    'field': 'username',
+    'message': 'Username already exists. Please choose a different one!',
+    'code': 'ALREADY_EXISTS'
+}
+
+
 def validate_form_data(username, password, check_existing_user=False):
     """Comprehensive form validation"""
     errors = []
@@ -145,13 +259,8 @@ def validate_form_data(username, password, check_existing_user=False):
     # Check if username already exists (for registration)
     if check_existing_user and username and len(username) >= 3:
         try:
-            existing_user = User.query.filter_by(username=username.strip()).first()
-            if existing_user:
-                errors.append({
-                    'field': 'username',
-                    'message': 'Username already exists. Please choose a different one!',
-                    'code': 'ALREADY_EXISTS'
-                })
+            if username_exists(username.strip()):
+                errors.append(USERNAME_TAKEN_ERROR)
         except Exception as e:
             logging.error(f"Error checking existing user: {e}")
             errors.append({
@@ -188,14 +297,28 @@ def configure_database():
         app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
         # COMPLETELY REMOVED BINDS - this was causing the issue
 
+        # psycopg2 batching: INSERTs of several rows go out as multi-VALUES statements, and executemany
+        # UPDATE/DELETE use execute_batch instead of one round trip per row
+        batch_options = {
+            'executemany_mode': 'values_plus_batch',
+            'insertmanyvalues_page_size': 1000,
+            'executemany_batch_page_size': 500,
+            # Room for every distinct statement the app compiles, so none are evicted and recompiled
+            'query_cache_size': 1200,
+        }
+
+        # Each gthread worker runs 8 request threads plus up to 16 chat-analysis threads that may each hold a
+        # connection, so the pool allows 30; streams themselves hold none. A short timeout surfaces exhaustion as
+        # an error instead of a half-minute stall.
         # Railway-optimized engine options
         if environment == 'railway':
             app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-                'pool_size': 5,
+                **batch_options,
+                'pool_size': 10,
                 'pool_recycle': 300,
                 'pool_pre_ping': True,
-                'max_overflow': 10,
-                'pool_timeout': 30,
+                'max_overflow': 20,
+                'pool_timeout': 10,
                 'connect_args': {
                     'connect_timeout': 10,
                     'application_name': 'AlexAI_Railway',
@@ -205,17 +328,26 @@ def configure_database():
         else:
             # Standard production settings
             app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+                **batch_options,
                 'pool_size': 10,
                 'pool_recycle': 120,
                 'pool_pre_ping': True,
                 'max_overflow': 20,
-                'pool_timeout': 30,
+                'pool_timeout': 10,
                 'connect_args': {
                     'connect_timeout': 10,
                     'application_name': 'AlexAI_Production'
                 }
             }
 
+        # DB_MAX_CONNECTIONS caps the whole deployment: it is split across the gunicorn workers (WEB_CONCURRENCY)
+        # so N workers can't open more connections than the server allows
+        if os.environ.get('DB_MAX_CONNECTIONS'):
+            workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+            per_worker = max(2, int(os.environ['DB_MAX_CONNECTIONS']) // workers - 1)
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(pool_size=per_worker, max_overflow=0)
+            logging.info(f"Database pool capped at {per_worker} connections per worker")
+
         logging.info("PostgreSQL database configured successfully")
 
     else:
@@ -227,22 +359,74 @@ def configure_database():
         app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{sqlite_path}'
         # NO BINDS FOR SQLITE EITHER
 
-        # SQLite engine options
+        # SQLite engine options - pooled connections shared across worker threads
         app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': 20,
+            'max_overflow': 40,
             'pool_pre_ping': True,
             'pool_recycle': 300,
+            'connect_args': {
+                'check_same_thread': False,
+                'timeout': 30
+            }
         }
 
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL journaling on SQLite so readers don't block writers and commits cost less fsync work"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+
+# --- Query Budget Check ---
+# Set QUERY_BUDGET_CHECK=1 (development/CI) to log any request that runs more SQL statements than its endpoint's
+# budget; lazy-loading N+1 regressions show up here long before they show up as latency
+QUERY_BUDGET_CHECK = os.environ.get('QUERY_BUDGET_CHECK') == '1'
+QUERY_BUDGETS = {
+    'chat': 16,
+    'load_conversation': 4,
+    'index': 4
+}
+DEFAULT_QUERY_BUDGET = 10
+
+if QUERY_BUDGET_CHECK:
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count_request_queries(conn, cursor, statement, parameters, context, executemany):
+        # Stored on the WSGI environ because /chat runs its queries inside a nested app context
+        if has_request_context():
+            request.environ.setdefault('alexai.sql_statements', []).append(statement)
+
+
+    @app.teardown_request
+    def check_query_budget(exc):
+        # Streamed responses tear down after the stream finishes, so their queries are included
+        statements = request.environ.pop('alexai.sql_statements', [])
+        budget = QUERY_BUDGETS.get(request.endpoint, DEFAULT_QUERY_BUDGET)
+        if len(statements) > budget:
+            logging.warning(f"Query budget exceeded for {request.endpoint}: {len(statements)} > {budget}\n"
+                            + "\n".join(statements))
+
 # Configure database
 configure_database()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Resolved once so health probes and admin endpoints read them from config instead of re-deriving per request
+app.config['DB_TYPE'] = 'PostgreSQL' if 'postgresql' in app.config['SQLALCHEMY_DATABASE_URI'] else 'SQLite'
+app.config['DB_URL_CONFIGURED'] = bool(os.environ.get('DATABASE_URL'))
 
 # Initialize db with app
 db.init_app(app)
 
 # --- Database Migration Setup ---
-migrate = Migrate(app, db)
+# Anchored to this file so init-db finds the migrations whatever directory the deploy runs it from
+migrate = Migrate(app, db, directory=os.path.join(os.path.abspath(os.path.dirname(__file__)), 'migrations'))
 
 # --- Login Manager Setup ---
 login_manager = LoginManager()
@@ -252,119 +436,369 @@ login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'info'
 login_manager.session_protection = "strong"
 
-# Import utility handlers with fallbacks
-try:
-    from utils.gemini_handler import initialize_gemini, get_response_stream, get_conversation_title
-    from utils.analysis_handler import analyze_sentiment
-    from utils.search_handler import is_realtime_query, fetch_realtime_info
-    from utils.memory_handler import MemoryManager
-    from utils.emotion_handler import EmotionAnalyzer
-    from utils.proactive_handler import ProactiveAssistant
-    from utils.automation_handler import TaskAutomationManager
-
-    UTILS_AVAILABLE = True
-    logging.info("All utility modules loaded successfully")
-except ImportError as e:
-    logging.warning(f"Some utility modules not found: {e}")
-    UTILS_AVAILABLE = False
-
-
-    # Create fallback functions
-    def initialize_gemini(history=None):
-        return None
+# --- AI Utility Handlers ---
+# The utility modules pull in the Gemini client, scikit-learn and friends, so they are imported on first use instead
+# of at startup; auth, static and health requests never pay for them. None until the first load.
+UTILS_AVAILABLE = None
 
 
-    def get_response_stream(chat_session, prompt_parts):
-        yield "AI response functionality not available. Please check your Gemini API configuration."
+@functools.cache
+def load_ai_utils():
+    """Import the utility handlers once per process, falling back to stubs when they are unavailable"""
+    global UTILS_AVAILABLE
+    try:
+        from utils.gemini_handler import initialize_gemini, get_response_stream, get_conversation_title
+        from utils.analysis_handler import analyze_sentiment, classify_prompt, PROMPT_REALTIME, PROMPT_MEMORY
+        from utils.search_handler import fetch_realtime_info
+        from utils.memory_handler import MemoryManager
+        from utils.emotion_handler import EmotionAnalyzer
+        from utils.proactive_handler import ProactiveAssistant
+        from utils.automation_handler import TaskAutomationManager
 
+        UTILS_AVAILABLE = True
+        logging.info("All utility modules loaded successfully")
+    except ImportError as e:
+        logging.warning(f"Some utility modules not found: {e}")
+        UTILS_AVAILABLE = False
 
-    def get_conversation_title(user_prompt, bot_response):
-        return f"Chat: {user_prompt[:30]}..."
 
+        # Create fallback functions
+        def initialize_gemini(history=None):
+            return None
 
-    def analyze_sentiment(text):
-        return {'positive': 0.5, 'neutral': 0.3, 'negative': 0.2}
+        def get_response_stream(chat_session, prompt_parts):
+            yield "AI response functionality not available. Please check your Gemini API configuration."
 
+        def get_conversation_title(user_prompt, bot_response):
+            return f"Chat: {user_prompt[:30]}..."
 
-    def is_realtime_query(query):
-        return False
+        def analyze_sentiment(text):
+            return {'positive': 0.5, 'neutral': 0.3, 'negative': 0.2}
+
+        PROMPT_REALTIME = 1
+        PROMPT_MEMORY = 2
+
+        def classify_prompt(text):
+            return 0
+
+        def fetch_realtime_info(query):
+            return "Real-time info not available"
+
+        class MemoryManager:
+            def __init__(self, user_id):
+                self.user_id = user_id
 
+            def retrieve_relevant_memories(self, query, limit=10):
+                return []
 
-    def fetch_realtime_info(query):
-        return "Real-time info not available"
+            def store_memory(self, memory_type, key, value, importance=1.0, commit=True):
+                pass
 
+            def invalidate_cache(self):
+                pass
 
-    class MemoryManager:
-        def __init__(self, user_id):
-            self.user_id = user_id
+        class EmotionAnalyzer:
+            def analyze_emotion(self, text, user_id, conversation_id, commit=True):
+                return {'neutral': 1.0}
 
-        def retrieve_relevant_memories(self, query, limit=10):
-            return []
+            def score_emotions(self, text):
+                return {'neutral': 1.0}
 
-        def store_memory(self, memory_type, key, value, importance=1.0):
-            pass
+            def log_emotions(self, user_id, conversation_id, emotions, commit=True):
+                pass
 
+            def get_emotion_trend(self, user_id, hours):
+                return []
 
-    class EmotionAnalyzer:
-        def analyze_emotion(self, text, user_id, conversation_id):
-            return {'neutral': 1.0}
+        class ProactiveAssistant:
+            def __init__(self, user_id):
+                self.user_id = user_id
 
-        def get_emotion_trend(self, user_id, hours):
-            return []
+            def generate_proactive_suggestions(self, context):
+                return []
 
+        class TaskAutomationManager:
+            def __init__(self, user_id):
+                self.user_id = user_id
 
-    class ProactiveAssistant:
-        def __init__(self, user_id):
-            self.user_id = user_id
+            def check_triggers(self, text, commit=True):
+                return []
 
-        def generate_proactive_suggestions(self, context):
-            return []
+            def execute_actions(self, actions):
+                return []
 
+            def create_automation(self, trigger, actions):
+                return 1
 
-    class TaskAutomationManager:
-        def __init__(self, user_id):
-            self.user_id = user_id
+            def get_automation_statistics(self):
+                return {'total': 0, 'active': 0}
 
-        def check_triggers(self, text):
-            return []
+    return SimpleNamespace(
+        initialize_gemini=initialize_gemini,
+        get_response_stream=get_response_stream,
+        get_conversation_title=get_conversation_title,
+        analyze_sentiment=analyze_sentiment,
+        classify_prompt=classify_prompt,
+        PROMPT_REALTIME=PROMPT_REALTIME,
+        PROMPT_MEMORY=PROMPT_MEMORY,
+        fetch_realtime_info=fetch_realtime_info,
+        MemoryManager=MemoryManager,
+        ProactiveAssistant=ProactiveAssistant,
+        TaskAutomationManager=TaskAutomationManager,
+        # The emotion analyzer holds no per-user state, so a single instance serves every request
+        emotion_analyzer=EmotionAnalyzer(),
+    )
 
-        def execute_actions(self, actions):
-            return []
 
-        def create_automation(self, trigger, actions):
-            return 1
+# Per-user handlers are built once and kept in a bounded LRU instead of being constructed on every chat turn
+USER_HANDLER_CACHE_SIZE = 1024
+_user_handlers = OrderedDict()
+_user_handlers_lock = threading.Lock()
 
-        def get_automation_statistics(self):
-            return {'total': 0, 'active': 0}
+
+def get_user_handlers(user_id):
+    """Return the cached (memory, proactive, automation) handlers for a user, creating them on first use"""
+    ai = load_ai_utils()
+    with _user_handlers_lock:
+        handlers = _user_handlers.get(user_id)
+        if handlers is None:
+            handlers = (ai.MemoryManager(user_id), ai.ProactiveAssistant(user_id), ai.TaskAutomationManager(user_id))
+            _user_handlers[user_id] = handlers
+        _user_handlers.move_to_end(user_id)
+        while len(_user_handlers) > USER_HANDLER_CACHE_SIZE:
+            _user_handlers.popitem(last=False)
+    return handlers
+
+
+# Flask-Login loads the user on every request; recently loaded users are reused for a short while, so current_user
+# is always a real User row and a deleted account stops authenticating within the TTL. Cached users are expunged
+# from their session so a later commit can't expire their attributes.
+USER_CACHE_TTL_SECONDS = 30
+_user_cache = TTLCache(maxsize=10000, ttl=USER_CACHE_TTL_SECONDS)
+_user_cache_lock = threading.Lock()
+
+
+def forget_cached_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
 
 
 @login_manager.user_loader
 def load_user(user_id):
     try:
+        user_id = int(user_id)
+        with _user_cache_lock:
+            user = _user_cache.get(user_id)
+        if user is not None:
+            return user
+
         # Enhanced user loading with better error handling
         user = db.session.execute(
-            db.select(User).where(User.id == int(user_id))
+            db.select(User).where(User.id == user_id)
         ).scalar_one_or_none()
 
         # Add debug logging for user loading
         logging.debug(f"Loading user {user_id}: {'Found' if user else 'Not found'}")
+        if user is not None:
+            db.session.expunge(user)
+            with _user_cache_lock:
+                _user_cache[user_id] = user
         return user
     except Exception as e:
         logging.error(f"Error loading user {user_id}: {e}")
         return None
 
 
-def save_message_to_db(conversation_id, role, content):
-    """Enhanced message saving with transaction management"""
+# Prefer orjson for Server-Sent Event payloads when it is installed
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+# Stop browsers and reverse proxies (nginx, Railway's edge) from caching or buffering the event stream
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+# Preformatted SSE frame pieces so the per-token path only concatenates bytes
+SSE_DATA_PREFIX = b"data: "
+SSE_FRAME_END = b"\n\n"
+SSE_EVENT_PREFIXES = {
+    name: b"event: " + name.encode('ascii') + b"\n" + SSE_DATA_PREFIX
+    for name in ('conversation', 'emotion', 'automation', 'proactive', 'sentiment', 'error')
+}
+# Model text frames only vary in the string, so the {"text": ...} wrapper is prebuilt too
+SSE_TEXT_PREFIX = SSE_DATA_PREFIX + b'{"text":'
+SSE_TEXT_SUFFIX = b'}' + SSE_FRAME_END
+
+
+# Small model chunks are coalesced into one SSE frame until this many characters or this many seconds accumulate
+SSE_FLUSH_CHARS = 4096
+SSE_FLUSH_INTERVAL = 0.03
+
+
+def dumps_bytes(payload):
+    """Serialize a payload to UTF-8 JSON bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode('utf-8')
+
+
+def sse_event(payload, event=None):
+    """Serialize a payload into a Server-Sent Event frame as bytes"""
+    data = dumps_bytes(payload)
+    if event:
+        return SSE_EVENT_PREFIXES[event] + data + SSE_FRAME_END
+    return SSE_DATA_PREFIX + data + SSE_FRAME_END
+
+
+def gzip_sse_frames(frames):
+    """Gzip an SSE byte stream, sync-flushing after every frame so each one still reaches the client immediately"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
     try:
-        message = Message(role=role, content=content, conversation_id=conversation_id)
-        db.session.add(message)
+        for frame in frames:
+            yield compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        # Propagate a client disconnect to the chat generator so it can commit what it staged
+        frames.close()
+
+
+def sse_text(text):
+    """Serialize a chunk of model text into a data frame, encoding only the string itself"""
+    return SSE_TEXT_PREFIX + dumps_bytes(text) + SSE_TEXT_SUFFIX
+
+
+# --- Background Analysis Pool ---
+# Independent per-turn analyses (emotion, sentiment, memory lookup, realtime search) run here so /chat waits for the
+# slowest of them rather than their sum
+analysis_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='chat-analysis')
+# Waiting on Gemini's first chunk can take seconds, so it gets its own pool (one thread per gunicorn request thread)
+# rather than holding analysis workers that other turns are queued on
+first_chunk_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chat-first-chunk')
+
+
+def close_model_stream(model_stream, first_chunk_future):
+    """Close a Gemini stream nobody will read; if the pool thread is still advancing it, close it once that ends"""
+    if first_chunk_future.cancel():
+        model_stream.close()
+    else:
+        # A generator can't be closed while another thread is running it, so this waits on the future without blocking
+        first_chunk_future.add_done_callback(lambda _: model_stream.close())
+
+
+def submit_with_app_context(func, *args, **kwargs):
+    """Run func on the analysis pool inside its own application context"""
+    def run():
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    return analysis_executor.submit(run)
+
+
+# Uploaded images larger than this are rejected before any decoding. The request-wide cap lets Werkzeug refuse
+# oversized bodies before the form is even parsed.
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+UPLOAD_READ_CHUNK_BYTES = 65536
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_BYTES + 1024 * 1024
+
+# Uploaded images are downscaled to fit within this box before being sent to Gemini
+MAX_IMAGE_DIMENSIONS = (1568, 1568)
+# Formats Gemini accepts as raw bytes; images in these formats that already fit are forwarded without decoding
+PASSTHROUGH_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+
+def read_capped(stream, max_bytes=MAX_IMAGE_BYTES):
+    """Read an upload; returns its bytes, or None if it exceeds max_bytes"""
+    if stream.seekable():
+        # Werkzeug spools uploads to a seekable buffer or temp file, so the size is checked without reading and the
+        # payload is read into a single bytes object with no intermediate copies
+        if stream.seek(0, io.SEEK_END) > max_bytes:
+            return None
+        stream.seek(0)
+        return stream.read()
+
+    data = bytearray()
+    while True:
+        chunk = stream.read(UPLOAD_READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > max_bytes:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def prepare_image_part(image_data):
+    """Return an image prompt part, sending the original bytes when no resize or conversion is needed"""
+    # Pillow is only imported once a chat actually carries an image
+    from PIL import Image
+
+    # Image.open only parses the header; pixels are decoded only if the image has to be downscaled
+    img = Image.open(io.BytesIO(image_data))
+    if img.format in PASSTHROUGH_IMAGE_FORMATS and \
+            img.width <= MAX_IMAGE_DIMENSIONS[0] and img.height <= MAX_IMAGE_DIMENSIONS[1]:
+        return {'mime_type': Image.MIME[img.format], 'data': image_data}
+
+    img.thumbnail(MAX_IMAGE_DIMENSIONS)
+    return img
+
+
+# Messages replayed into a rebuilt Gemini session; older turns are dropped so long chats don't grow every rebuild
+HISTORY_MESSAGE_LIMIT = 40
+
+# --- Gemini Chat Session Cache ---
+# Live chat sessions keyed by conversation id, each tagged with the id of the last message it has seen.
+# A session is only reused when that id still matches the conversation, so turns handled elsewhere force a rebuild.
+CHAT_SESSION_CACHE_SIZE = 512
+_chat_sessions = OrderedDict()
+_chat_sessions_lock = threading.Lock()
+
+
+def take_cached_chat_session(conversation_id, last_message_id):
+    """Check out a cached chat session if it is in sync with the conversation"""
+    with _chat_sessions_lock:
+        entry = _chat_sessions.pop(conversation_id, None)
+    if entry and entry[1] == last_message_id:
+        return entry[0]
+    return None
+
+
+def store_chat_session(conversation_id, chat_session, last_message_id):
+    """Return a chat session to the cache, evicting the least recently used ones"""
+    with _chat_sessions_lock:
+        _chat_sessions[conversation_id] = (chat_session, last_message_id)
+        _chat_sessions.move_to_end(conversation_id)
+        while len(_chat_sessions) > CHAT_SESSION_CACHE_SIZE:
+            _chat_sessions.popitem(last=False)
+
+
+def save_message_to_db(conversation_id, role, content, created_at=None):
+    """Stage a message on the session; the caller commits the surrounding transaction"""
+    message = Message(role=role, content=content, conversation_id=conversation_id)
+    if created_at is not None:
+        message.created_at = created_at
+    db.session.add(message)
+    logging.debug(f"Message staged: {role} in conversation {conversation_id}")
+    return message
+
+
+def commit_chat_transaction():
+    """Commit the pending chat writes in a single transaction, rolling back on failure; returns whether it committed"""
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            # Chat writes don't wait for the WAL flush; a crash can lose the last few turns but never corrupts data
+            db.session.execute(db.text('SET LOCAL synchronous_commit TO OFF'))
         db.session.commit()
-        logging.debug(f"Message saved: {role} in conversation {conversation_id}")
+        return True
     except Exception as e:
-        logging.error(f"Error saving message: {e}")
+        logging.error(f"Error committing chat transaction: {e}")
         db.session.rollback()
-        raise
+        return False
 
 
 # --- FIXED Database Migration Functions ---
@@ -410,8 +844,32 @@ def perform_database_migration():
         raise
 
 
-def initialize_database_with_migration():
-    """FIXED database initialization with proper application context and error handling"""
+# Indexes earlier releases created that the models no longer declare
+OBSOLETE_INDEXES = (
+    'ix_emotion_log_user_id_created_at',
+    # Superseded by ix_message_conversation_id_id, which has conversation_id as its leading column
+    'ix_message_conversation_id',
+)
+
+
+def create_missing_indexes():
+    """Create model indexes that an existing schema is missing (create_all only builds them with new tables)"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+    # Drop indexes left behind by removed models so they stop costing a write on every insert
+    with db.engine.begin() as connection:
+        for index_name in OBSOLETE_INDEXES:
+            connection.execute(db.text(f'DROP INDEX IF EXISTS {index_name}'))
+
+
+def initialize_database_with_migration(allow_sqlite_fallback=True):
+    """FIXED database initialization with proper application context and error handling
+
+    With allow_sqlite_fallback=False (the init-db deploy step) any failure is raised instead of silently switching
+    to emergency_fallback.db, so a broken database fails the deploy.
+    """
     try:
         with app.app_context():
             # Test database connection first
@@ -422,11 +880,12 @@ def initialize_database_with_migration():
                 logging.error(f"Database connection failed: {conn_error}")
 
                 # Check if we're in development and should fall back to SQLite
-                if not os.environ.get('DATABASE_URL'):
+                if allow_sqlite_fallback and not os.environ.get('DATABASE_URL'):
                     logging.info("Falling back to SQLite for development")
                     basedir = os.path.abspath(os.path.dirname(__file__))
                     sqlite_path = os.path.join(basedir, 'emergency_fallback.db')
                     app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{sqlite_path}'
+                    app.config['DB_TYPE'] = 'SQLite'
                     # REMOVED BINDS CONFIGURATION - this was causing issues
 
                     # Reinitialize db with new config
@@ -443,16 +902,21 @@ def initialize_database_with_migration():
             else:
                 logging.info("Database schema is up to date")
 
+            # Column changes to existing tables live in migrations/ (create_all never alters a table)
+            upgrade_database()
+            create_missing_indexes()
+
             # Final connection test
             db.session.execute(db.text('SELECT 1'))
             db.session.commit()
 
             # Log database info
-            db_type = 'PostgreSQL' if 'postgresql' in app.config['SQLALCHEMY_DATABASE_URI'] else 'SQLite'
-            logging.info(f"Database initialization completed successfully using {db_type}")
+            logging.info(f"Database initialization completed successfully using {app.config['DB_TYPE']}")
 
     except Exception as e:
         logging.error(f"Database initialization failed: {e}")
+        if not allow_sqlite_fallback:
+            raise
 
         # Emergency fallback to SQLite
         try:
@@ -553,7 +1017,7 @@ def list_users():
             return jsonify({
                 'total_users': len(users),
                 'users': user_list,
-                'database_type': 'PostgreSQL' if 'postgresql' in app.config['SQLALCHEMY_DATABASE_URI'] else 'SQLite'
+                'database_type': app.config['DB_TYPE']
             })
 
     except Exception as e:
@@ -591,7 +1055,7 @@ def create_single_user(username, password):
                 'username': username,
                 'password': password,
                 'user_id': user_id,
-                'database_type': 'PostgreSQL' if 'postgresql' in app.config['SQLALCHEMY_DATABASE_URI'] else 'SQLite'
+                'database_type': app.config['DB_TYPE']
             })
 
     except Exception as e:
@@ -703,30 +1167,34 @@ def debug_db_status():
 
 
 # --- Enhanced Session Validation Middleware ---
+# Static files, auth routes, and debug routes skip validation
+SESSION_EXEMPT_ENDPOINTS = frozenset({
+    'static', 'login', 'register', 'logout', 'force_logout', 'health_check',
+    'favicon', 'validate_field', 'debug_users', 'create_test_user', 'debug_db_status',
+    'create_default_users', 'list_users', 'create_single_user'})
+# API routes that don't require auth
+SESSION_EXEMPT_PATH_PREFIXES = ('/api/auth/status', '/api/validate', '/debug', '/admin')
+
+
 @app.before_request
 def validate_session():
     """Enhanced session validation that doesn't interfere with logout"""
-    # Skip validation for static files, auth routes, and debug routes
-    skip_endpoints = ['static', 'login', 'register', 'logout', 'force_logout', 'health_check',
-                      'favicon', 'validate_field', 'debug_users', 'create_test_user', 'debug_db_status',
-                      'create_default_users', 'list_users', 'create_single_user']
-
-    if request.endpoint in skip_endpoints:
+    # Asset requests return before anything touches current_user, which would load the session and the user
+    if request.path.startswith('/static/'):
         return
 
-    # Skip validation for API routes that don't require auth
-    if (request.path.startswith('/api/auth/status') or
-            request.path.startswith('/api/validate') or
-            request.path.startswith('/debug') or
-            request.path.startswith('/admin')):
+    if request.endpoint in SESSION_EXEMPT_ENDPOINTS or request.path.startswith(SESSION_EXEMPT_PATH_PREFIXES):
         return
 
     if current_user.is_authenticated:
         # Check session timeout
         if 'last_activity' in session:
             try:
-                last_activity = datetime.fromisoformat(session['last_activity'])
-                if datetime.utcnow() - last_activity > app.config['PERMANENT_SESSION_LIFETIME']:
+                last_activity = session['last_activity']
+                if isinstance(last_activity, str):
+                    # Sessions issued before timestamps were stored as epoch seconds
+                    last_activity = datetime.fromisoformat(last_activity).replace(tzinfo=timezone.utc).timestamp()
+                if time.time() - last_activity > SESSION_TTL_SECONDS:
                     logout_user()
                     session.clear()
                     flash('Your session has expired. Please log in again.', 'warning')
@@ -737,8 +1205,12 @@ def validate_session():
                 session.clear()
                 return redirect(url_for('login'))
 
-        # Update last activity timestamp
-        session['last_activity'] = datetime.utcnow().isoformat()
+        # Update last activity timestamp; writing the session re-signs the cookie, so it is only refreshed once
+        # the stored value is a minute stale
+        now = int(time.time())
+        last_activity = session.get('last_activity')
+        if not isinstance(last_activity, (int, float)) or now - last_activity > SESSION_ACTIVITY_WRITE_INTERVAL:
+            session['last_activity'] = now
 
 
 # --- ENHANCED Authentication Routes ---
@@ -780,18 +1252,24 @@ def login():
 
         try:
             with app.app_context():  # Ensure proper application context
-                user = User.query.filter_by(username=username).first()
+                user = find_user_by_username(username)
                 logging.info(f"User query result: {'Found' if user else 'Not found'}")
 
-                if user and user.check_password(password):
+                password_ok = user.check_password(password) if user else User.check_dummy_password(password)
+                if user and password_ok:
+                    # Persist a password hash that check_password upgraded
+                    if user in db.session.dirty:
+                        db.session.commit()
+
                     # Clear any existing session data
                     session.clear()
 
                     # Login user
                     login_user(user, remember=True)
                     session.permanent = True
-                    session['login_time'] = datetime.utcnow().isoformat()
-                    session['last_activity'] = datetime.utcnow().isoformat()
+                    now = int(time.time())
+                    session['login_time'] = now
+                    session['last_activity'] = now
 
                     success_message = f'Welcome back, {user.username}!'
                     logging.info(f"User {user.username} logged in successfully")
@@ -837,6 +1315,24 @@ def login():
     return render_template('login.html')
 
 
+def registration_error_response(validation_errors):
+    """Answer a rejected registration as JSON or a re-rendered form, matching how it was submitted"""
+    error_response = {
+        'success': False,
+        'errors': validation_errors,
+        'message': validation_errors[0]['message']
+    }
+
+    if request.is_json:
+        return jsonify(error_response), 400
+    else:
+        for error in validation_errors:
+            flash(error['message'], 'error')
+        return render_template('register.html',
+                               errors=validation_errors,
+                               error=validation_errors[0]['message'])
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
@@ -855,24 +1351,12 @@ def register():
         # Add debug logging
         logging.info(f"Registration attempt for username: {username}")
 
-        # Comprehensive validation
-        validation_errors = validate_form_data(username, password, check_existing_user=True)
+        # Comprehensive validation; a taken username is caught by the unique constraint on insert instead of a
+        # separate lookup first
+        validation_errors = validate_form_data(username, password)
 
         if validation_errors:
-            error_response = {
-                'success': False,
-                'errors': validation_errors,
-                'message': validation_errors[0]['message']
-            }
-
-            if request.is_json:
-                return jsonify(error_response), 400
-            else:
-                for error in validation_errors:
-                    flash(error['message'], 'error')
-                return render_template('register.html',
-                                       errors=validation_errors,
-                                       error=validation_errors[0]['message'])
+            return registration_error_response(validation_errors)
 
         try:
             with app.app_context():  # Ensure proper application context
@@ -882,11 +1366,8 @@ def register():
                 new_user.set_password(password)
 
                 db.session.add(new_user)
-                db.session.flush()
-                user_id = new_user.id
-
                 db.session.commit()
-                logging.info(f"Successfully registered user {username} with ID {user_id}")
+                logging.info(f"Successfully registered user {username} with ID {new_user.id}")
 
                 success_message = 'Registration successful! Please log in.'
 
@@ -900,6 +1381,9 @@ def register():
                     flash(success_message, 'success')
                     return redirect(url_for('login'))
 
+        except IntegrityError:
+            db.session.rollback()
+            return registration_error_response([USERNAME_TAKEN_ERROR])
         except Exception as e:
             db.session.rollback()
             logging.error(f"Registration error for {username}: {e}")
@@ -935,8 +1419,7 @@ def validate_field():
             if not errors and field_value:
                 try:
                     with app.app_context():
-                        existing_user = User.query.filter_by(username=field_value.strip()).first()
-                        if existing_user:
+                        if username_exists(field_value.strip()):
                             errors.append({
                                 'field': 'username',
                                 'message': 'Username already exists!',
@@ -977,6 +1460,8 @@ def logout():
         logging.info(f"User {username} (ID: {user_id}) initiating logout")
 
         # Perform Flask-Login logout first
+        if current_user.is_authenticated:
+            forget_cached_user(current_user.id)
         logout_user()
 
         # Clear all session data
@@ -1015,6 +1500,7 @@ def force_logout():
     try:
         if current_user.is_authenticated:
             username = getattr(current_user, 'username', 'Unknown')
+            forget_cached_user(current_user.id)
             logout_user()
             logging.info(f"Force logout executed for user: {username}")
 
@@ -1029,56 +1515,122 @@ def force_logout():
     return response
 
 
+# The sidebar's (id, title) list only changes when a conversation is created or titled, so it is cached per user
+CONVERSATION_LIST_TTL_SECONDS = 60
+_conversation_lists = TTLCache(maxsize=1000, ttl=CONVERSATION_LIST_TTL_SECONDS)
+_conversation_lists_lock = threading.Lock()
+
+
+# The sidebar renders the newest page of conversations; older pages are fetched on demand
+CONVERSATION_PAGE_SIZE = 50
+
+
+def fetch_conversation_page(user_id, before_id=None):
+    """Return up to CONVERSATION_PAGE_SIZE (id, title) rows older than before_id, and whether more remain"""
+    # The sidebar only shows links, so fetch (id, title) rows rather than full Conversation objects
+    stmt = db.select(Conversation.id, Conversation.title).where(
+        Conversation.user_id == user_id).order_by(Conversation.id.desc()).limit(CONVERSATION_PAGE_SIZE + 1)
+    if before_id is not None:
+        stmt = stmt.where(Conversation.id < before_id)
+    rows = db.session.execute(stmt).all()
+    return rows[:CONVERSATION_PAGE_SIZE], len(rows) > CONVERSATION_PAGE_SIZE
+
+
+def get_conversation_list(user_id):
+    """Return the user's newest page of (id, title) rows and whether older ones exist"""
+    with _conversation_lists_lock:
+        page = _conversation_lists.get(user_id)
+    if page is None:
+        page = fetch_conversation_page(user_id)
+        with _conversation_lists_lock:
+            _conversation_lists[user_id] = page
+    return page
+
+
+def forget_conversation_list(user_id):
+    with _conversation_lists_lock:
+        _conversation_lists.pop(user_id, None)
+
+
 @app.route("/")
 @login_required
 def index():
+    # A new chat renders without a conversation row; /chat creates it with the first message
     try:
-        new_convo = Conversation(user_id=current_user.id)
-        db.session.add(new_convo)
-        db.session.commit()
-        return redirect(url_for('load_conversation', conversation_id=new_convo.id))
+        all_conversations, more_conversations = get_conversation_list(current_user.id)
     except Exception as e:
-        logging.error(f"Error creating new conversation: {e}")
-        db.session.rollback()
-        flash('Error creating new conversation.', 'error')
-        return render_template('index.html', conversations=[], active_conversation=None)
+        logging.error(f"Error loading conversations: {e}")
+        all_conversations, more_conversations = [], False
+    return render_template('index.html', conversations=all_conversations, more_conversations=more_conversations,
+                           active_conversation=None)
 
 
 @app.route("/conversation/<int:conversation_id>")
 @login_required
 def load_conversation(conversation_id):
     try:
-        conversation = db.session.get(Conversation, conversation_id)
+        conversation = db.session.get(Conversation, conversation_id,
+                                      options=[selectinload(Conversation.messages)])
         if conversation and conversation.user_id == current_user.id:
-            all_conversations = Conversation.query.filter_by(user_id=current_user.id).order_by(
-                Conversation.id.desc()).all()
-            return render_template("index.html", conversations=all_conversations, active_conversation=conversation)
+            all_conversations, more_conversations = get_conversation_list(current_user.id)
+            return render_template("index.html", conversations=all_conversations,
+                                   more_conversations=more_conversations, active_conversation=conversation)
         return redirect(url_for('index'))
     except Exception as e:
         logging.error(f"Error loading conversation {conversation_id}: {e}")
         return redirect(url_for('index'))
 
 
+@app.route('/api/conversations')
+@login_required
+def list_conversations():
+    """Page through the user's conversations older than ?before=<id>, newest first"""
+    conversations, has_more = fetch_conversation_page(current_user.id, request.args.get('before', type=int))
+    return jsonify({
+        'conversations': [{'id': conv.id, 'title': conv.title} for conv in conversations],
+        'has_more': has_more
+    })
+
+
+# A successful database probe is trusted for this long so frequent liveness checks don't each hit the database
+HEALTH_CHECK_CACHE_SECONDS = 5.0
+_last_healthy_db_check = 0.0
+
+
 @app.route('/health')
 def health_check():
     """Enhanced health check endpoint with database connectivity test"""
+    global _last_healthy_db_check
+    db_type = app.config['DB_TYPE']
     try:
-        # Test database connection
-        db.session.execute(db.text('SELECT 1'))
+        # Test database connection on a raw pooled connection, skipping ORM session setup
+        if time.monotonic() - _last_healthy_db_check > HEALTH_CHECK_CACHE_SECONDS:
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+            _last_healthy_db_check = time.monotonic()
         db_status = 'connected'
-        db_type = 'PostgreSQL' if 'postgresql' in app.config['SQLALCHEMY_DATABASE_URI'] else 'SQLite'
     except Exception as e:
         logging.error(f"Database health check failed: {e}")
         db_status = f'error: {str(e)}'
         db_type = 'unknown'
 
+    # Pool counters are read from memory, so they cost nothing per probe
+    pool = db.engine.pool
+    pool_stats = {
+        'size': pool.size(),
+        'checkedin': pool.checkedin(),
+        'checkedout': pool.checkedout(),
+        'overflow': pool.overflow()
+    } if hasattr(pool, 'checkedout') else None
+
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
         'database': {
             'status': db_status,
             'type': db_type,
-            'url_configured': bool(os.environ.get('DATABASE_URL'))
+            'url_configured': app.config['DB_URL_CONFIGURED'],
+            'pool': pool_stats
         },
         'utils_available': UTILS_AVAILABLE,
         'environment': get_environment()
@@ -1126,50 +1678,117 @@ def internal_error(error):
 @app.route("/chat", methods=["POST"])
 @login_required
 def chat():
+    # The user's message is timestamped when the prompt arrives, not when its row is written
+    received_at = datetime.utcnow()
     user_prompt = request.form.get("prompt", "")
     image_file = request.files.get("image")
+    # A new chat has no conversation yet; it is created together with its first message
     conversation_id = request.form.get("conversation_id", type=int)
 
-    image_data = image_file.read() if image_file else None
-
-    if not conversation_id:
-        return jsonify({"error": "Missing conversation ID."}), 400
-
     user_id = current_user.id
 
-    # Verify conversation ownership
-    initial_conversation = db.session.get(Conversation, conversation_id)
-    if not initial_conversation or initial_conversation.user_id != user_id:
-        return jsonify({"error": "Unauthorized"}), 403
+    # Verify conversation ownership and fetch its latest message id in one round trip. The indexed MAX() tells
+    # the generator both whether this is the first exchange and which message a cached Gemini session must have
+    # seen, without loading the message list.
+    last_message_id = None
+    if conversation_id:
+        latest_message = db.select(func.max(Message.id)).where(
+            Message.conversation_id == Conversation.id).scalar_subquery()
+        owned = db.session.execute(db.select(Conversation.id, latest_message).where(
+            Conversation.id == conversation_id, Conversation.user_id == user_id)).first()
+        if owned is None:
+            return jsonify({"error": "Unauthorized"}), 403
+        last_message_id = owned[1]
+
+    image_data = None
+    if image_file:
+        image_data = read_capped(image_file.stream)
+        if image_data is None:
+            return jsonify({"error": "Image is too large."}), 413
+
+    # The generator runs in its own app context and session; hand this request's connection back to the pool
+    # now rather than holding it until the stream finishes
+    db.session.close()
 
     def generate_and_save():
+        nonlocal conversation_id
         with app.app_context():
             full_bot_response = ""
-            try:
-                conversation = db.session.get(Conversation, conversation_id)
-                if not conversation:
-                    raise ValueError("Conversation not found inside generator.")
+            user_message = None
+            memory_staged = False
+            model_stream = None
+            first_chunk_future = None
+
+            def stage_user_message():
+                # The user message goes out with the turn's first commit, so the prompt survives a worker dying
+                # mid-stream; exit paths reached before that commit stage it themselves
+                nonlocal user_message
+                if user_message is None and conversation_id:
+                    user_message = save_message_to_db(conversation_id, 'user', user_prompt, received_at)
+
+            def commit_turn():
+                # Memory lookups cached in Redis are only retired once the memory rows are visible to other requests
+                nonlocal memory_staged
+                committed = commit_chat_transaction()
+                if committed and memory_staged:
+                    memory_manager.invalidate_cache()
+                memory_staged = False
+                return committed
 
-                # Initialize AI components with your utility modules
-                memory_manager = MemoryManager(user_id)
-                emotion_analyzer = EmotionAnalyzer()
-                proactive_assistant = ProactiveAssistant(user_id)
-                automation_manager = TaskAutomationManager(user_id)
-
-                is_first_exchange = len(conversation.messages) == 0
+            try:
+                # Fetch the shared AI components for this user
+                ai = load_ai_utils()
+                memory_manager, proactive_assistant, automation_manager = get_user_handlers(user_id)
+
+                # Kick off the independent analyses first so they overlap the history queries below; results are
+                # collected where they are needed
+                emotion_future = submit_with_app_context(ai.emotion_analyzer.score_emotions, user_prompt)
+                sentiment_future = submit_with_app_context(ai.analyze_sentiment, user_prompt or " ")
+                memories_future = submit_with_app_context(memory_manager.retrieve_relevant_memories, user_prompt)
+                prompt_flags = ai.classify_prompt(user_prompt)
+                realtime_future = None
+                if image_data is None and prompt_flags & ai.PROMPT_REALTIME:
+                    realtime_future = submit_with_app_context(ai.fetch_realtime_info, user_prompt)
+
+                if not conversation_id:
+                    # The new conversation is flushed for its id and committed with the first message; the
+                    # client learns the id from the first event
+                    conversation = Conversation(user_id=user_id)
+                    db.session.add(conversation)
+                    db.session.flush()
+                    conversation_id = conversation.id
+                    yield sse_event({'id': conversation_id}, 'conversation')
+                is_first_exchange = last_message_id is None
+                stage_user_message()
+
+                # Reuse the live Gemini session for this conversation when it is still in sync; otherwise build
+                # history from a role/content projection of the most recent messages. The bound on last_message_id
+                # keeps out the user message staged above (autoflush would otherwise return it), since the prompt
+                # is sent to the model separately.
+                chat_session = take_cached_chat_session(conversation_id, last_message_id)
+                history = None
+                if chat_session is None and not is_first_exchange:
+                    recent = db.session.query(Message.role, Message.content).filter(
+                        Message.conversation_id == conversation_id, Message.id <= last_message_id).order_by(
+                        Message.id.desc()).limit(HISTORY_MESSAGE_LIMIT).all()
+                    history = [{'role': role, 'parts': [{'text': content}]} for role, content in reversed(recent)]
+                    # Gemini expects the history to open with a user turn
+                    while history and history[0]['role'] != 'user':
+                        history.pop(0)
 
                 # 1. EMOTION ANALYSIS - Stream emotion data
-                emotions = emotion_analyzer.analyze_emotion(user_prompt, user_id, conversation_id)
-                yield f"event: emotion\ndata: {json.dumps(emotions)}\n\n"
+                emotions = emotion_future.result()
+                ai.emotion_analyzer.log_emotions(user_id, conversation_id, emotions, commit=False)
+                yield sse_event(emotions, 'emotion')
 
                 # 2. TASK AUTOMATION - Check for automation triggers
-                triggered_actions = automation_manager.check_triggers(user_prompt)
+                triggered_actions = automation_manager.check_triggers(user_prompt, commit=False)
                 if triggered_actions:
                     automation_results = automation_manager.execute_actions(triggered_actions)
-                    yield f"event: automation\ndata: {json.dumps(automation_results)}\n\n"
+                    yield sse_event(automation_results, 'automation')
 
                 # 3. MEMORY RETRIEVAL - Get relevant context
-                relevant_memories = memory_manager.retrieve_relevant_memories(user_prompt)
+                relevant_memories = memories_future.result()
                 memory_context = "\n".join(
                     [f"{getattr(m, 'key', '')}: {getattr(m, 'value', '')}" for m in relevant_memories])
 
@@ -1181,24 +1800,23 @@ def chat():
                 })
 
                 if proactive_suggestions:
-                    yield f"event: proactive\ndata: {json.dumps(proactive_suggestions)}\n\n"
-
-                # Save user message
-                save_message_to_db(conversation_id, 'user', user_prompt)
+                    yield sse_event(proactive_suggestions, 'proactive')
 
                 # 5. MEMORY STORAGE - Store important information
-                if any(keyword in user_prompt.lower() for keyword in ['remember', 'important', 'deadline', 'meeting', 'appointment']):
-                    memory_manager.store_memory('user_request', 'important_info', user_prompt, importance=1.5)
-
-                # Load conversation history for context
-                history = [{'role': msg.role, 'parts': [{'text': msg.content}]} for msg in conversation.messages[:-1]]
+                if prompt_flags & ai.PROMPT_MEMORY:
+                    memory_manager.store_memory('user_request', 'important_info', user_prompt, importance=1.5,
+                                                commit=False)
+                    memory_staged = True
 
                 # Initialize Gemini with enhanced error handling
-                chat_session = initialize_gemini(history=history)
+                if chat_session is None:
+                    chat_session = ai.initialize_gemini(history=history)
                 if not chat_session:
                     error_msg = "AI service is currently unavailable. Please check your API configuration."
-                    yield f"data: {json.dumps({'text': error_msg})}\n\n"
+                    yield sse_text(error_msg)
+                    stage_user_message()
                     save_message_to_db(conversation_id, 'model', error_msg)
+                    commit_turn()
                     return
 
                 # 6. ENHANCED PROMPT PREPARATION - Add context and emotion awareness
@@ -1219,44 +1837,86 @@ def chat():
 
                 # Prepare prompt parts for multimodal support
                 prompt_parts = []
-                if image_data:
+                if image_data is not None:
                     try:
-                        img = Image.open(io.BytesIO(image_data))
-                        prompt_parts.extend([enhanced_prompt, img])
+                        prompt_parts.extend([enhanced_prompt, prepare_image_part(image_data)])
                         logging.info("Image processed successfully for multimodal input")
                     except Exception as img_error:
                         logging.error(f"Image processing error: {img_error}")
                         prompt_parts.append(enhanced_prompt)
-                elif is_realtime_query(user_prompt):
+                elif realtime_future:
                     # Use real-time search for current information
-                    context = fetch_realtime_info(user_prompt)
+                    context = realtime_future.result()
                     prompt_parts.append(f"Real-time information: '{context}'. User question: '{enhanced_prompt}'")
                     logging.info("Real-time information retrieved for query")
                 else:
                     prompt_parts.append(enhanced_prompt)
 
                 # 7. SENTIMENT ANALYSIS - Stream sentiment data
-                sentiment_scores = analyze_sentiment(user_prompt or " ")
-                yield f"event: sentiment\ndata: {json.dumps(sentiment_scores)}\n\n"
-
-                # 8. AI RESPONSE GENERATION - Stream the response
+                sentiment_scores = sentiment_future.result()
+                yield sse_event(sentiment_scores, 'sentiment')
+
+                # 8. AI RESPONSE GENERATION - Gemini's first chunk is requested on its own pool so the commit below
+                # overlaps the model's time to first token instead of delaying it
+                model_stream = ai.get_response_stream(chat_session, prompt_parts)
+                first_chunk_future = first_chunk_executor.submit(next, model_stream, None)
+
+                # Persist the user message and everything else staged so far in one transaction while the model
+                # works; if it fails the user message is staged again with the reply. The turn deliberately keeps
+                # this commit separate from the one after the stream: it makes the prompt durable, hands the
+                # connection back to the pool and releases SQLite's write lock for the length of the stream.
+                if not commit_turn():
+                    user_message = None
+
+                # Stream the response
+                stream_completed = False
+                pending_chunks = []
+                pending_chars = 0
+                last_flush = time.monotonic()
                 try:
-                    stream_generator = get_response_stream(chat_session, prompt_parts)
+                    # The pool thread only advanced the stream once; the rest is consumed here
+                    first_chunk = first_chunk_future.result()
+                    stream_generator = model_stream if first_chunk is None else \
+                        itertools.chain((first_chunk,), model_stream)
                     for chunk_text in stream_generator:
                         if chunk_text:
                             full_bot_response += chunk_text
-                            yield f"data: {json.dumps({'text': chunk_text})}\n\n"
+                            pending_chunks.append(chunk_text)
+                            pending_chars += len(chunk_text)
+                            now = time.monotonic()
+                            if pending_chars >= SSE_FLUSH_CHARS or now - last_flush >= SSE_FLUSH_INTERVAL:
+                                yield sse_text(''.join(pending_chunks))
+                                pending_chunks.clear()
+                                pending_chars = 0
+                                last_flush = now
+                    if pending_chunks:
+                        yield sse_text(''.join(pending_chunks))
+                    stream_completed = True
                 except Exception as stream_error:
                     logging.error(f"Streaming error: {stream_error}")
                     error_response = "I apologize, but I encountered an error while generating a response. Please try again."
                     full_bot_response = error_response
-                    yield f"data: {json.dumps({'text': error_response})}\n\n"
+                    yield sse_text(error_response)
 
-                # Save bot response
+                # Stage the bot response, plus the user message if the first commit failed
+                stage_user_message()
+                bot_message = None
                 if full_bot_response:
-                    save_message_to_db(conversation_id, 'model', full_bot_response)
+                    bot_message = save_message_to_db(conversation_id, 'model', full_bot_response)
 
-                # 9. INTERACTION PATTERN STORAGE - Learn from the conversation
+                # 9. CONVERSATION TITLE GENERATION - For first exchange
+                if is_first_exchange and full_bot_response:
+                    try:
+                        title = ai.get_conversation_title(user_prompt, full_bot_response)
+                        if title:
+                            # Ownership was checked before streaming, so the title is written without loading the row
+                            db.session.execute(db.update(Conversation).where(
+                                Conversation.id == conversation_id).values(title=title))
+                            logging.info(f"Generated conversation title: {title}")
+                    except Exception as title_error:
+                        logging.error(f"Title generation error: {title_error}")
+
+                # 10. INTERACTION PATTERN STORAGE - Learn from the conversation
                 memory_manager.store_memory('interaction_pattern',
                                             f"query_type_{datetime.now().strftime('%Y%m%d')}",
                                             {
@@ -1266,26 +1926,62 @@ def chat():
                                                 'sentiment': sentiment_scores,
                                                 'had_automation': bool(triggered_actions),
                                                 'used_memory': bool(memory_context)
-                                            })
-
-                # 10. CONVERSATION TITLE GENERATION - For first exchange
-                if is_first_exchange and full_bot_response:
-                    try:
-                        title = get_conversation_title(user_prompt, full_bot_response)
-                        if title:
-                            conversation.title = title
-                            db.session.commit()
-                            logging.info(f"Generated conversation title: {title}")
-                    except Exception as title_error:
-                        logging.error(f"Title generation error: {title_error}")
-
+                                            },
+                                            commit=False)
+                memory_staged = True
+
+                # Persist bot response, title and interaction pattern in the turn's second transaction
+                commit_turn()
+                if is_first_exchange:
+                    forget_conversation_list(user_id)
+
+                # Keep the session for the next turn; image turns are not cached so the image isn't resent. The id
+                # comes from the identity key because reading the expired attribute would reload the row and check
+                # out a connection again.
+                bot_identity = sa_inspect(bot_message).identity if bot_message is not None else None
+                if stream_completed and bot_identity and image_data is None:
+                    store_chat_session(conversation_id, chat_session, bot_identity[0])
+
+            except GeneratorExit:
+                # Client aborted the stream; keep the user message and whatever was staged before it went away
+                if first_chunk_future is not None:
+                    close_model_stream(model_stream, first_chunk_future)
+                stage_user_message()
+                commit_turn()
+                raise
             except Exception as e:
                 logging.error(f"Error during response generation: {e}")
+                if first_chunk_future is not None:
+                    close_model_stream(model_stream, first_chunk_future)
                 error_msg = "I apologize, but I encountered an error. Please try again."
-                yield f"event: error\ndata: {json.dumps({'error': 'A server error occurred.'})}\n\n"
-                save_message_to_db(conversation_id, 'model', error_msg)
+                yield sse_event({'error': 'A server error occurred.'}, 'error')
+                if conversation_id:
+                    stage_user_message()
+                    save_message_to_db(conversation_id, 'model', error_msg)
+                commit_turn()
+
+    # Frames share one gzip stream when the client accepts it; the repeated event/JSON framing compresses well
+    body = generate_and_save()
+    headers = SSE_HEADERS
+    if request.accept_encodings['gzip']:
+        body = gzip_sse_frames(body)
+        headers = {**SSE_HEADERS, 'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'}
+
+    # Keep the request context alive while the response streams
+    return Response(stream_with_context(body), mimetype='text/event-stream', headers=headers,
+                    direct_passthrough=True)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create tables and indexes; run once per deploy instead of on every worker import"""
+    try:
+        initialize_database_with_migration(allow_sqlite_fallback=False)
+    except Exception as e:
+        # A non-zero exit fails the release/preDeploy step rather than deploying against a fallback database
+        logging.critical(f"Database initialization failed: {e}")
+        sys.exit(1)
+    logging.info("Database initialized")
 
-    return Response(generate_and_save(), mimetype='text/event-stream')
 
 # --- Main Application Entry Point ---
 if __name__ == "__main__":
@@ -1298,9 +1994,16 @@ if __name__ == "__main__":
         sys.exit(1)
 
     port = int(os.environ.get('PORT', 5000))
-    app.run(host="0.0.0.0", port=port, debug=False)
-else:
-    # For production deployments (gunicorn, etc.)
+    if GEVENT_ENABLED:
+        from gevent.pywsgi import WSGIServer
+
+        logging.info(f"Serving with gevent on port {port}")
+        WSGIServer(('0.0.0.0', port), app).serve_forever()
+    else:
+        app.run(host="0.0.0.0", port=port, debug=False)
+elif os.environ.get('INIT_DB') == '1':
+    # For production deployments (gunicorn, etc.) schema setup normally runs once via `flask init-db`;
+    # INIT_DB=1 restores initialization on import
     try:
         initialize_database_with_migration()
         logging.info("Production application initialization successful")
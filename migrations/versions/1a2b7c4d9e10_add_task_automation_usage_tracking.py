@@ -0,0 +1,36 @@
+"""add task automation usage tracking
+
+Revision ID: 1a2b7c4d9e10
+Revises: 
+Create Date: 2026-10-15 23:25:06.285104
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b7c4d9e10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _existing_columns():
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns('task_automation')}
+
+
+def upgrade():
+    # Databases created by init-db after the model gained these columns already have them
+    existing_columns = _existing_columns()
+    with op.batch_alter_table('task_automation', schema=None) as batch_op:
+        if 'usage_count' not in existing_columns:
+            batch_op.add_column(sa.Column('usage_count', sa.Integer(), server_default='0', nullable=False))
+        if 'last_used' not in existing_columns:
+            batch_op.add_column(sa.Column('last_used', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('task_automation', schema=None) as batch_op:
+        batch_op.drop_column('last_used')
+        batch_op.drop_column('usage_count')
@@ -0,0 +1,32 @@
+"""add user memory trigram index
+
+Revision ID: 5c8e3f0a2b41
+Revises: 1a2b7c4d9e10
+Create Date: 2026-10-15 23:41:12.518730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8e3f0a2b41'
+down_revision = '1a2b7c4d9e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # UserMemory.search ranks with pg_trgm's similarity(); SQLite ranks memories with TF-IDF instead
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # The expression must match UserMemory.search_text() for the planner to use the index
+    op.execute("CREATE INDEX IF NOT EXISTS ix_user_memory_search_trgm ON user_memory "
+               "USING gin ((coalesce(key, '') || ' ' || coalesce(value, '')) gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_user_memory_search_trgm")
@@ -1,9 +1,21 @@
 # models.py
+import functools
+import secrets
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+
+    # Built once with OWASP-recommended Argon2id parameters; hashing and verifying run in native code
+    password_hasher = PasswordHasher(time_cost=2, memory_cost=19 * 1024, parallelism=1)
+    ARGON2_AVAILABLE = True
+except ImportError:
+    ARGON2_AVAILABLE = False
+
 db = SQLAlchemy()
 
 
@@ -24,10 +36,42 @@ class User(UserMixin, db.Model):
     proactive_tasks = db.relationship('ProactiveTask', backref='user', lazy=True, cascade="all, delete-orphan")
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        if ARGON2_AVAILABLE:
+            self.password_hash = password_hasher.hash(password)
+        else:
+            self.password_hash = generate_password_hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if ARGON2_AVAILABLE and self.password_hash.startswith('$argon2'):
+            try:
+                password_hasher.verify(self.password_hash, password)
+            except (VerificationError, InvalidHashError):
+                return False
+            if password_hasher.check_needs_rehash(self.password_hash):
+                self.password_hash = password_hasher.hash(password)
+            return True
+
+        # Legacy Werkzeug hash; upgrade it to Argon2 once the password is known to be correct
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if ARGON2_AVAILABLE:
+            self.password_hash = password_hasher.hash(password)
+        return True
+
+    @staticmethod
+    def check_dummy_password(password):
+        """Run a hash verification that always fails, so a login for an unknown username takes as long as one
+        with a wrong password"""
+        User(password_hash=_dummy_password_hash()).check_password(password)
+        return False
+
+
+@functools.cache
+def _dummy_password_hash():
+    # Hashed on first use with the same scheme set_password uses for new accounts
+    user = User()
+    user.set_password(secrets.token_urlsafe(16))
+    return user.password_hash
 
 
 class UserProfile(db.Model):
@@ -43,6 +87,10 @@ class UserProfile(db.Model):
 class Conversation(db.Model):
     __tablename__ = 'conversation'
     # REMOVED: __bind_key__ = 'chats'  # This was causing the foreign key issue
+    __table_args__ = (
+        # Serves the per-user conversation list (user_id = ? ORDER BY id DESC) with a backward index scan
+        db.Index('ix_conversation_user_id_id', 'user_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), default="New Conversation")
@@ -50,13 +98,19 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationships
-    messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan")
+    messages = db.relationship('Message', backref='conversation', lazy=True, cascade="all, delete-orphan",
+                               order_by='Message.id')
     emotion_logs = db.relationship('EmotionLog', backref='conversation', lazy=True, cascade="all, delete-orphan")
 
 
 class Message(db.Model):
     __tablename__ = 'message'
     # REMOVED: __bind_key__ = 'chats'  # This was causing the foreign key issue
+    __table_args__ = (
+        # Serves the per-conversation MAX(id) and newest-first history reads as index range scans
+        db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),
+        db.Index('ix_message_created_at', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     role = db.Column(db.String(10), nullable=False)
@@ -67,6 +121,10 @@ class Message(db.Model):
 
 class UserMemory(db.Model):
     __tablename__ = 'user_memory'
+    __table_args__ = (
+        db.Index('ix_user_memory_user_id', 'user_id'),
+        db.Index('ix_user_memory_user_id_importance', 'user_id', 'importance_score'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -76,6 +134,24 @@ class UserMemory(db.Model):
     importance_score = db.Column(db.Float, default=1.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @classmethod
+    def most_important(cls, user_id, limit):
+        """A user's memories by importance, newest first among equals"""
+        return cls.query.filter_by(user_id=user_id) \
+            .order_by(cls.importance_score.desc(), cls.id.desc()).limit(limit).all()
+
+    @classmethod
+    def search_text(cls):
+        """The key and value as one string; matches the expression of the ix_user_memory_search_trgm index"""
+        # Literal SQL rather than bound parameters, so the emitted expression is the one the index was built on
+        return db.literal_column("coalesce(user_memory.key, '') || ' ' || coalesce(user_memory.value, '')")
+
+    @classmethod
+    def search(cls, user_id, query, limit=5):
+        """Rank a user's memories by trigram similarity to the query weighted by importance (needs pg_trgm)"""
+        score = cls.importance_score * db.func.similarity(cls.search_text(), query)
+        return cls.query.filter_by(user_id=user_id).order_by(score.desc(), cls.id.desc()).limit(limit).all()
+
 
 class TaskAutomation(db.Model):
     __tablename__ = 'task_automation'
@@ -85,6 +161,8 @@ class TaskAutomation(db.Model):
     trigger_phrase = db.Column(db.String(200))
     actions = db.Column(db.JSON)
     is_active = db.Column(db.Boolean, default=True)
+    usage_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    last_used = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
@@ -427,6 +427,43 @@ function setupRegistrationValidation() {
     }
 }
 
+// --- Conversation List Paging ---
+function initializeConversationPaging() {
+    const loadMoreButton = document.querySelector('.load-more-conversations');
+    if (!loadMoreButton) return;
+
+    // Older conversations are fetched a page at a time and inserted above the button
+    loadMoreButton.addEventListener('click', async () => {
+        loadMoreButton.disabled = true;
+        try {
+            const response = await fetch(`/api/conversations?before=${loadMoreButton.dataset.before}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            const data = await response.json();
+
+            data.conversations.forEach(conv => {
+                const item = document.createElement('a');
+                item.href = `/conversation/${conv.id}`;
+                item.className = 'conversation-item';
+                item.textContent = conv.title || 'New Conversation';
+                item.setAttribute('aria-label', `Load conversation: ${item.textContent}`);
+                loadMoreButton.before(item);
+            });
+
+            if (data.has_more && data.conversations.length) {
+                loadMoreButton.dataset.before = data.conversations[data.conversations.length - 1].id;
+                loadMoreButton.disabled = false;
+            } else {
+                loadMoreButton.remove();
+            }
+        } catch (error) {
+            console.error('Error loading conversations:', error);
+            loadMoreButton.disabled = false;
+        }
+    });
+}
+
 // --- Mobile-Specific Functions ---
 function initializeMobileMenu() {
     // Only create mobile menu if it doesn't exist
@@ -1002,20 +1039,33 @@ function setupEventListeners() {
 
                 const reader = response.body.getReader();
                 const decoder = new TextDecoder();
+                // A frame can span several reads (large coalesced or gzipped chunks), so the unfinished tail is
+                // carried over and only complete "\n\n"-terminated events are parsed
+                let buffer = '';
 
                 while (true) {
                     const { value, done } = await reader.read();
                     if (done) break;
 
-                    const chunk = decoder.decode(value);
-                    const lines = chunk.split('\n');
-
-                    for (let i = 0; i < lines.length; i++) {
-                        const line = lines[i];
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split('\n\n');
+                    buffer = events.pop();
+
+                    for (const rawEvent of events) {
+                        let eventType = null;
+                        let payload = null;
+                        for (const line of rawEvent.split('\n')) {
+                            if (line.startsWith('event: ')) {
+                                eventType = line.slice(7);
+                            } else if (line.startsWith('data: ')) {
+                                payload = line.slice(6);
+                            }
+                        }
+                        if (payload === null) continue;
 
-                        if (line.startsWith('data: ')) {
+                        if (!eventType) {
                             try {
-                                const data = JSON.parse(line.slice(6));
+                                const data = JSON.parse(payload);
                                 if (data.text) {
                                     fullResponse += data.text;
                                     if (!botMessageElement) {
@@ -1031,24 +1081,23 @@ function setupEventListeners() {
                             } catch (parseError) {
                                 console.error('Error parsing JSON:', parseError);
                             }
-                        } else if (line.startsWith('event: ')) {
-                            const eventType = line.slice(7);
-                            const nextLine = lines[i + 1];
-                            if (nextLine && nextLine.startsWith('data: ')) {
-                                try {
-                                    const eventData = JSON.parse(nextLine.slice(6));
-
-                                    if (eventType === 'sentiment') {
-                                        updateUserMessageWithSentiment(userMessageElement, eventData);
-                                    } else if (eventType === 'error') {
-                                        throw new Error(eventData.error);
-                                    } else {
-                                        handleSpecialEvents(eventType, eventData);
-                                    }
-                                    i++;
-                                } catch (parseError) {
-                                    console.error(`Error parsing ${eventType} data:`, parseError);
+                        } else {
+                            try {
+                                const eventData = JSON.parse(payload);
+
+                                if (eventType === 'conversation') {
+                                    // A new chat got its conversation id; later messages continue it
+                                    conversationIdInput.value = eventData.id;
+                                    history.replaceState(null, '', `/conversation/${eventData.id}`);
+                                } else if (eventType === 'sentiment') {
+                                    updateUserMessageWithSentiment(userMessageElement, eventData);
+                                } else if (eventType === 'error') {
+                                    throw new Error(eventData.error);
+                                } else {
+                                    handleSpecialEvents(eventType, eventData);
                                 }
+                            } catch (parseError) {
+                                console.error(`Error parsing ${eventType} data:`, parseError);
                             }
                         }
                     }
@@ -1179,6 +1228,7 @@ document.addEventListener("DOMContentLoaded", () => {
     // Initialize page and setup event listeners
     initializePage();
     setupEventListeners();
+    initializeConversationPaging();
 
     // Setup form validation
     setupLoginValidation();
@@ -1,8 +1,131 @@
-from textblob import TextBlob
+import os
+import re
+from functools import lru_cache
+
+# Set SENTIMENT_BACKEND=textblob to use TextBlob's full pattern lexicon instead of the built-in word lists
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "lexicon").lower()
+
+# TextBlob (and its corpora) is only imported when it is the configured backend
+TEXTBLOB_AVAILABLE = False
+if SENTIMENT_BACKEND == "textblob":
+    try:
+        from textblob import TextBlob
+
+        TEXTBLOB_AVAILABLE = True
+    except ImportError:
+        pass
+
+NEUTRAL_SENTIMENT = {"polarity": 0.0, "subjectivity": 0.0}
+
+_TOKEN_PATTERN = re.compile(r"[a-z']+")
+
+# Prompt classification flags, OR-ed together by classify_prompt
+PROMPT_REALTIME = 1
+PROMPT_MEMORY = 2
+
+REALTIME_KEYWORDS = frozenset({
+    'weather', 'price', 'prices', 'cost', 'costs', 'stock', 'stocks', 'temperature', 'temp', 'news',
+    'latest', 'current'
+})
+REALTIME_PHRASES = ("how much", "what is the time", "capital of")
+
+# Whole-token matching, so the inflected forms the old substring check picked up are listed explicitly
+MEMORY_KEYWORDS = frozenset({
+    'remember', 'remembered', 'remembering', 'remembers', 'important', 'importantly',
+    'deadline', 'deadlines', 'meeting', 'meetings', 'appointment', 'appointments'
+})
+
+_POSITIVE_WORDS = frozenset({
+    'good', 'great', 'awesome', 'amazing', 'excellent', 'fantastic', 'wonderful', 'perfect', 'love', 'loved',
+    'like', 'liked', 'happy', 'glad', 'excited', 'nice', 'best', 'better', 'beautiful', 'brilliant', 'cool',
+    'enjoy', 'enjoyed', 'fun', 'helpful', 'thanks', 'thank', 'appreciate', 'pleased', 'delighted', 'success',
+    'successful', 'win', 'won', 'easy', 'calm', 'relaxed', 'proud', 'grateful', 'positive', 'superb', 'yay'
+})
+
+_NEGATIVE_WORDS = frozenset({
+    'bad', 'terrible', 'awful', 'horrible', 'worst', 'worse', 'hate', 'hated', 'sad', 'angry', 'upset',
+    'annoyed', 'annoying', 'frustrated', 'frustrating', 'stressed', 'stress', 'anxious', 'worried', 'tired',
+    'exhausted', 'overwhelmed', 'broken', 'wrong', 'fail', 'failed', 'failure', 'problem', 'issue', 'bug',
+    'error', 'hard', 'difficult', 'confused', 'boring', 'disappointed', 'sick', 'hurt', 'lonely', 'negative',
+    'ugly', 'stupid', 'useless'
+})
+
+_NEGATIONS = frozenset({'not', 'no', 'never', 'nothing', 'nobody', 'none', 'neither', 'nor', 'without', 'hardly'})
+
+# How many tokens a negation keeps flipping the sentiment of the following word
+_NEGATION_WINDOW = 3
+
+
+@lru_cache(maxsize=256)
+def _tokenize_lower(text_lower: str) -> tuple:
+    # Prompt classification and emotion scoring both tokenize the same prompt each turn; the second is a cache hit
+    return tuple(_TOKEN_PATTERN.findall(text_lower))
+
+
+def tokenize(text: str) -> tuple:
+    return _tokenize_lower(text.lower())
+
+
+@lru_cache(maxsize=4096)
+def classify_prompt(text: str) -> int:
+    """Tag a prompt with PROMPT_* flags in a single tokenization pass; repeated prompts are a cache hit"""
+    text_lower = text.lower()
+    tokens = set(_tokenize_lower(text_lower))
+
+    flags = 0
+    if not REALTIME_KEYWORDS.isdisjoint(tokens) or any(phrase in text_lower for phrase in REALTIME_PHRASES):
+        flags |= PROMPT_REALTIME
+    if not MEMORY_KEYWORDS.isdisjoint(tokens):
+        flags |= PROMPT_MEMORY
+    return flags
+
+
+def _lexicon_sentiment(normalized_text: str) -> tuple:
+    tokens = _TOKEN_PATTERN.findall(normalized_text)
+    if not tokens:
+        return 0.0, 0.0
+
+    score = 0
+    hits = 0
+    negation_left = 0
+    for token in tokens:
+        if token in _NEGATIONS or token.endswith("n't"):
+            negation_left = _NEGATION_WINDOW
+            continue
+
+        weight = 1 if token in _POSITIVE_WORDS else -1 if token in _NEGATIVE_WORDS else 0
+        if weight:
+            score += -weight if negation_left else weight
+            hits += 1
+            negation_left = 0
+        elif negation_left:
+            negation_left -= 1
+
+    if not hits:
+        return 0.0, 0.0
+    return round(score / hits, 2), round(min(1.0, 3 * hits / len(tokens)), 2)
+
+
+def _textblob_sentiment(normalized_text: str) -> tuple:
+    blob = TextBlob(normalized_text)
+    return round(blob.sentiment.polarity, 2), round(blob.sentiment.subjectivity, 2)
+
+
+@lru_cache(maxsize=4096)
+def _score_sentiment(normalized_text: str) -> tuple:
+    if SENTIMENT_BACKEND == "textblob" and TEXTBLOB_AVAILABLE:
+        return _textblob_sentiment(normalized_text)
+    return _lexicon_sentiment(normalized_text)
+
+
 def analyze_sentiment(text: str) -> dict:
-    blob = TextBlob(text)
+    normalized_text = " ".join(text.lower().split())
+    if len(normalized_text) < 3:
+        return dict(NEUTRAL_SENTIMENT)
+
+    polarity, subjectivity = _score_sentiment(normalized_text)
     sentiment = {
-        "polarity": round(blob.sentiment.polarity, 2),
-        "subjectivity": round(blob.sentiment.subjectivity, 2)
+        "polarity": polarity,
+        "subjectivity": subjectivity
     }
-    return sentiment
\ No newline at end of file
+    return sentiment
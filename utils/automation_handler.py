@@ -1,10 +1,26 @@
 import json
+import random
+import threading
 from datetime import datetime, timedelta
+from cachetools import TTLCache
 from flask import current_app
+from sqlalchemy import update
 from models import db, TaskAutomation
 import requests
 import re
 
+try:
+    import ahocorasick
+
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Per-user trigger index: (automaton or None, {trigger phrase: [automation ids]}). Entries are dropped when this
+# process creates an automation and expire after a minute so changes made by other workers are picked up too.
+_trigger_indexes = TTLCache(maxsize=10000, ttl=60)
+_trigger_indexes_lock = threading.Lock()
+
 
 class TaskAutomationManager:
     def __init__(self, user_id):
@@ -55,26 +71,75 @@ class TaskAutomationManager:
         )
         db.session.add(automation)
         db.session.commit()
+        with _trigger_indexes_lock:
+            _trigger_indexes.pop(self.user_id, None)
         return automation.id
 
-    def check_triggers(self, user_message):
-        """Check if user message triggers any automations"""
-        user_message_lower = user_message.lower()
-        triggered_actions = []
+    def _get_trigger_index(self):
+        """Return the user's active trigger phrases, built from the database on a cache miss"""
+        with _trigger_indexes_lock:
+            index = _trigger_indexes.get(self.user_id)
+        if index is not None:
+            return index
 
-        # Check custom automations first
-        automations = TaskAutomation.query.filter(
+        phrase_ids = {}
+        rows = db.session.query(TaskAutomation.id, TaskAutomation.trigger_phrase).filter(
             TaskAutomation.user_id == self.user_id,
             TaskAutomation.is_active == True
-        ).all()
+        )
+        for automation_id, trigger_phrase in rows:
+            if trigger_phrase:
+                phrase_ids.setdefault(trigger_phrase, []).append(automation_id)
+
+        automaton = None
+        if AHOCORASICK_AVAILABLE and phrase_ids:
+            automaton = ahocorasick.Automaton()
+            for trigger_phrase, automation_ids in phrase_ids.items():
+                automaton.add_word(trigger_phrase, automation_ids)
+            automaton.make_automaton()
+
+        index = (automaton, phrase_ids)
+        with _trigger_indexes_lock:
+            _trigger_indexes[self.user_id] = index
+        return index
+
+    def _match_automation_ids(self, user_message_lower):
+        automaton, phrase_ids = self._get_trigger_index()
+        if not phrase_ids:
+            return set()
+        if automaton is not None:
+            # One pass over the message finds every trigger phrase, however many the user has
+            return {automation_id for _, automation_ids in automaton.iter(user_message_lower)
+                    for automation_id in automation_ids}
+        return {automation_id for trigger_phrase, automation_ids in phrase_ids.items()
+                if trigger_phrase in user_message_lower for automation_id in automation_ids}
+
+    def check_triggers(self, user_message, commit=True):
+        """Check if user message triggers any automations; commit=False leaves usage updates staged"""
+        user_message_lower = user_message.lower()
+        triggered_actions = []
 
-        for automation in automations:
-            if automation.trigger_phrase in user_message_lower:
+        # Check custom automations first; rows are only loaded for the triggers that matched
+        matched_ids = self._match_automation_ids(user_message_lower)
+        if matched_ids:
+            automations = TaskAutomation.query.filter(
+                TaskAutomation.id.in_(matched_ids),
+                TaskAutomation.is_active == True
+            ).order_by(TaskAutomation.id).all()
+
+            for automation in automations:
                 triggered_actions.extend(automation.actions)
-                # Update usage statistics
-                automation.usage_count += 1
-                automation.last_used = datetime.utcnow()
-                db.session.commit()
+
+            if automations:
+                # Update usage statistics for every triggered automation in one UPDATE
+                db.session.execute(
+                    update(TaskAutomation)
+                    .where(TaskAutomation.id.in_([automation.id for automation in automations]))
+                    .values(usage_count=TaskAutomation.usage_count + 1, last_used=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                if commit:
+                    db.session.commit()
 
         # Check default automations
         for trigger, actions in self.default_automations.items():
@@ -194,7 +259,6 @@ class TaskAutomationManager:
             "The harder you work for something, the greater you'll feel when you achieve it."
         ]
 
-        import random
         quote = random.choice(motivational_quotes)
 
         return {
@@ -240,7 +304,6 @@ class TaskAutomationManager:
             "Lo-fi Study Vibes"
         ]
 
-        import random
         selected_playlist = random.choice(playlists)
 
         return {
@@ -317,7 +380,6 @@ class TaskAutomationManager:
             "Calm Acoustic"
         ]
 
-        import random
         selected_playlist = random.choice(playlists)
 
         return {
@@ -336,7 +398,6 @@ class TaskAutomationManager:
             "Study Beats"
         ]
 
-        import random
         selected_playlist = random.choice(playlists)
 
         return {
@@ -1,42 +1,43 @@
+import logging
 from datetime import datetime, timedelta
 from flask import current_app
 from models import db, EmotionLog
+from utils.analysis_handler import analyze_sentiment, tokenize
 
-try:
-    from textblob import TextBlob
+# Matched against whole tokens, so inflected forms are listed alongside each indicator
+STRESS_INDICATORS = frozenset({
+    'stressed', 'overwhelmed', 'anxious', 'worried', 'frustrated',
+    'tired', 'exhausted', 'deadline', 'deadlines', 'urgent', 'urgently',
+    'pressure', 'pressured', 'pressures'
+})
 
-    TEXTBLOB_AVAILABLE = True
-except ImportError:
-    TEXTBLOB_AVAILABLE = False
+HAPPINESS_INDICATORS = frozenset({
+    'happy', 'excited', 'great', 'greater', 'greatest', 'greatly', 'awesome', 'wonderful',
+    'fantastic', 'amazing', 'amazingly', 'love', 'loved', 'loves', 'loving', 'lovely',
+    'perfect', 'perfectly', 'excellent'
+})
 
 
 class EmotionAnalyzer:
-    def __init__(self):
-        self.stress_indicators = [
-            'stressed', 'overwhelmed', 'anxious', 'worried', 'frustrated',
-            'tired', 'exhausted', 'deadline', 'urgent', 'pressure'
-        ]
-
-        self.happiness_indicators = [
-            'happy', 'excited', 'great', 'awesome', 'wonderful',
-            'fantastic', 'amazing', 'love', 'perfect', 'excellent'
-        ]
-
-    def analyze_emotion(self, text, user_id, conversation_id):
-        """Analyze emotion from text"""
-        if TEXTBLOB_AVAILABLE:
-            blob = TextBlob(text.lower())
-            polarity = blob.sentiment.polarity
-            subjectivity = blob.sentiment.subjectivity
-        else:
-            # Simple fallback analysis
-            polarity = 0.0
-            subjectivity = 0.5
+
+    def analyze_emotion(self, text, user_id, conversation_id, commit=True):
+        """Analyze emotion from text and log it"""
+        emotions = self.score_emotions(text)
+        self.log_emotions(user_id, conversation_id, emotions, commit=commit)
+        return emotions
+
+    def score_emotions(self, text):
+        """Score emotions from text without touching the database"""
+        # Same scorer (and cache) as the sentiment event, so both events agree on polarity
+        sentiment = analyze_sentiment(text)
+        polarity = sentiment['polarity']
+        subjectivity = sentiment['subjectivity']
 
         # Pattern-based emotion detection
-        text_lower = text.lower()
-        stress_score = sum(1 for word in self.stress_indicators if word in text_lower) / max(len(text.split()), 1)
-        happiness_score = sum(1 for word in self.happiness_indicators if word in text_lower) / max(len(text.split()), 1)
+        tokens = tokenize(text)
+        token_set = set(tokens)
+        stress_score = len(STRESS_INDICATORS & token_set) / max(len(tokens), 1)
+        happiness_score = len(HAPPINESS_INDICATORS & token_set) / max(len(tokens), 1)
 
         # Calculate emotion scores
         emotions = {
@@ -51,7 +52,14 @@ class EmotionAnalyzer:
         if total > 0:
             emotions = {k: v / total for k, v in emotions.items()}
 
-        # Store emotion log with CORRECT column name
+        return emotions
+
+    def log_emotions(self, user_id, conversation_id, emotions, commit=True):
+        """Store an emotion log; with commit=False it is only staged for the caller's transaction"""
+        # Purely neutral results carry no signal and are the common case for short messages, so they aren't logged
+        if emotions.get('neutral') == 1.0 and not emotions.get('happiness') and not emotions.get('stress'):
+            return
+
         try:
             emotion_log = EmotionLog(
                 user_id=user_id,
@@ -60,14 +68,13 @@ class EmotionAnalyzer:
             )
 
             db.session.add(emotion_log)
-            db.session.commit()
+            if commit:
+                db.session.commit()
 
         except Exception as e:
             logging.error(f"Error storing emotion log: {e}")
             db.session.rollback()
 
-        return emotions
-
     def get_emotion_trend(self, user_id, hours=24):
         """Get recent emotion trends"""
         since = datetime.utcnow() - timedelta(hours=hours)
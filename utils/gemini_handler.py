@@ -1,20 +1,90 @@
 import os
+import itertools
+import logging
+import threading
+import time
 import google.generativeai as genai
-from PIL import Image
-import io
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+
+GEMINI_MODEL_NAME = 'models/gemini-2.5-flash'
+# How long a rate-limited API key is skipped before it is tried again
+KEY_COOLDOWN_SECONDS = 30
+
+# --- API key pool ---
+# One model per configured key, handed out round-robin. Keys that hit their quota cool down for a while.
+_key_pool = []
+_key_cooldowns = {}
+_key_cursor = itertools.count()
+_key_pool_lock = threading.Lock()
+
+
+def _load_api_keys():
+    """Read GEMINI_API_KEYS (comma-separated), falling back to the single-key variables"""
+    keys = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+    if not keys:
+        single_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+        if single_key:
+            keys = [single_key]
+    return keys
+
+
+def _build_model(api_key):
+    """Build a model whose requests are sent with api_key"""
+    model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    # google-generativeai 0.8 has no public per-model key; genai.configure() is process-wide. The model's lazily
+    # created client slot is filled with a client for this key instead, and the slot is checked first so an SDK
+    # change that drops it is reported rather than silently sending every request with the default key.
+    if getattr(model, '_client', False) is not None:
+        logging.error("google-generativeai no longer exposes a per-model client; Gemini key rotation is disabled")
+        genai.configure(api_key=api_key)
+        return model
+    model._client = glm.GenerativeServiceClient(client_options={'api_key': api_key})
+    return model
+
+
+def _next_model(exclude=()):
+    """Return the next (api_key, model) pair, preferring keys that are not cooling down"""
+    with _key_pool_lock:
+        if not _key_pool:
+            _key_pool.extend((key, _build_model(key)) for key in _load_api_keys())
+
+        candidates = [entry for entry in _key_pool if entry[0] not in exclude]
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        for _ in range(len(_key_pool)):
+            key, model = _key_pool[next(_key_cursor) % len(_key_pool)]
+            if key not in exclude and _key_cooldowns.get(key, 0) <= now:
+                return key, model
+
+        # Every remaining key is cooling down; use the one that recovers first
+        return min(candidates, key=lambda entry: _key_cooldowns.get(entry[0], 0))
+
+
+def _mark_rate_limited(model):
+    """Put the key behind a model on cooldown and return it"""
+    with _key_pool_lock:
+        for key, pooled_model in _key_pool:
+            if pooled_model is model:
+                _key_cooldowns[key] = time.monotonic() + KEY_COOLDOWN_SECONDS
+                return key
+    return None
+
 
-# This function is correct as is.
 def initialize_gemini(history=None):
     if history is None:
         history = []
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-2.5-flash')
-        chat = model.start_chat(history=history)
+        entry = _next_model()
+        if entry is None:
+            logging.critical("Error initializing Gemini: no API key configured")
+            return None
+        chat = entry[1].start_chat(history=history)
         return chat
     except Exception as e:
-        print(f"CRITICAL ERROR initializing Gemini: {e}")
+        logging.critical(f"Error initializing Gemini: {e}")
         return None
 
 # --- THIS IS THE ONLY FUNCTION THAT IS CHANGED ---
@@ -28,15 +98,32 @@ def get_response_stream(chat_session, prompt_parts):
     try:
         # The prompt_parts list is already correctly formatted by app.py
         # We don't need to build it here anymore.
-        print(f"-> Getting stream from Gemini with {len(prompt_parts)} part(s).")
-        stream = chat_session.send_message(prompt_parts, stream=True)
+        logging.info(f"Getting stream from Gemini with {len(prompt_parts)} part(s)")
+        session = chat_session
+        tried_keys = set()
+        while True:
+            try:
+                stream = session.send_message(prompt_parts, stream=True)
+                break
+            except google_exceptions.ResourceExhausted as e:
+                # Fail over to another key with a fresh chat that replays the same history
+                tried_keys.add(_mark_rate_limited(session.model))
+                fallback = _next_model(exclude=tried_keys)
+                if fallback is None:
+                    raise
+                logging.warning(f"Gemini key rate limited, failing over to another key: {e}")
+                session = fallback[1].start_chat(history=chat_session.history)
 
         for chunk in stream:
             if chunk.text:
                 yield chunk.text
 
+        if session is not chat_session:
+            # The caller keeps chat_session for the next turn, so it takes over the completed exchange
+            chat_session.history = session.history
+
     except Exception as e:
-        print(f"Error during Gemini stream: {e}")
+        logging.error(f"Error during Gemini stream: {e}")
         raise e
 
 # This function is correct as is.
@@ -45,7 +132,10 @@ def get_conversation_title(user_prompt: str, model_response: str) -> str:
     Generates a short, descriptive title for a conversation.
     """
     try:
-        model = genai.GenerativeModel('models/gemini-2.5-flash')
+        entry = _next_model()
+        if entry is None:
+            return "New Conversation"
+        model = entry[1]
         title_prompt = (
             "Generate a very short, concise title (5-7 words maximum) for the following "
             "conversation. The title should be suitable for a sidebar history entry. "
@@ -55,25 +145,26 @@ def get_conversation_title(user_prompt: str, model_response: str) -> str:
         )
         response = model.generate_content(title_prompt)
         title = response.text.strip().replace('"', '')
-        print(f"-> Generated title: '{title}'")
+        logging.info(f"Generated title: '{title}'")
         return title
     except Exception as e:
-        print(f"Error generating conversation title: {e}")
+        logging.error(f"Error generating conversation title: {e}")
         return "New Conversation"
 
 # This function is correct as is.
 def get_realtime_response_stream(prompt_with_context: str):
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-2.5-flash')
+        entry = _next_model()
+        if entry is None:
+            raise ConnectionError("No Gemini API key configured.")
+        model = entry[1]
         safety_config = {
             'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
             'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
             'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
             'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE',
         }
-        print(f"-> Getting REALTIME stream from Gemini with prompt: '{prompt_with_context}'")
+        logging.info(f"Getting realtime stream from Gemini with prompt: '{prompt_with_context}'")
         response_stream = model.generate_content(
             prompt_with_context,
             stream=True,
@@ -83,5 +174,5 @@ def get_realtime_response_stream(prompt_with_context: str):
             if chunk.text:
                 yield chunk.text
     except Exception as e:
-        print(f"Error during REALTIME Gemini stream: {e}")
+        logging.error(f"Error during realtime Gemini stream: {e}")
         raise e
\ No newline at end of file
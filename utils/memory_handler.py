@@ -1,11 +1,22 @@
+import hashlib
 import json
+import logging
+import os
 from datetime import datetime, timedelta
 from flask import current_app
+from sqlalchemy.exc import DBAPIError
 from models import db, UserMemory  # Import from models instead of app
 
+try:
+    import redis
+
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
 try:
     from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
+    from sklearn.metrics.pairwise import linear_kernel
     import numpy as np
 
     SKLEARN_AVAILABLE = True
@@ -13,14 +24,41 @@ except ImportError:
     SKLEARN_AVAILABLE = False
 
 
+# Retrieved memories are cached in Redis (when REDIS_URL is set) per user and query. Each user has a version
+# counter that is bumped on writes, so stale entries are simply never read again and expire on their own.
+MEMORY_CACHE_TTL_SECONDS = 300
+_redis_client = redis.Redis.from_url(os.environ['REDIS_URL']) \
+    if REDIS_AVAILABLE and os.environ.get('REDIS_URL') else None
+
+_CACHED_MEMORY_FIELDS = ('id', 'user_id', 'memory_type', 'key', 'value', 'importance_score')
+
+# TF-IDF ranking only looks at a user's most important memories instead of loading every row they have
+MEMORY_CANDIDATE_LIMIT = 200
+# Cleared the first time PostgreSQL reports similarity() as undefined (pg_trgm is not installed); other failures
+# only fall back to TF-IDF for that one call
+UNDEFINED_FUNCTION_PGCODE = '42883'
+_trigram_search_available = True
+
+
 class MemoryManager:
     def __init__(self, user_id):
         self.user_id = user_id
-        if SKLEARN_AVAILABLE:
-            self.vectorizer = TfidfVectorizer(max_features=100, stop_words='english')
 
-    def store_memory(self, memory_type, key, value, importance=1.0):
-        """Store a memory with importance scoring"""
+    def _version_key(self):
+        return f"mem:ver:{self.user_id}"
+
+    def invalidate_cache(self):
+        """Retire the user's cached memory lookups; call only once memory writes are committed"""
+        if _redis_client is None:
+            return
+        try:
+            _redis_client.incr(self._version_key())
+        except redis.RedisError as e:
+            logging.warning(f"Memory cache invalidation failed: {e}")
+
+    def store_memory(self, memory_type, key, value, importance=1.0, commit=True):
+        """Store a memory with importance scoring; with commit=False it is only staged on the session, and the
+        caller invalidates the cache after committing"""
         memory = UserMemory(
             user_id=self.user_id,
             memory_type=memory_type,
@@ -29,19 +67,58 @@ class MemoryManager:
             importance_score=importance
         )
         db.session.add(memory)
-        db.session.commit()
+        if commit:
+            db.session.commit()
+            # Bumped after the commit so a concurrent lookup can't re-cache rows read before it
+            self.invalidate_cache()
 
     def retrieve_relevant_memories(self, query, limit=5):
-        """Retrieve memories relevant to current query"""
-        memories = UserMemory.query.filter_by(user_id=self.user_id).all()
+        """Retrieve memories relevant to current query, served from Redis when cached"""
+        if _redis_client is None:
+            return self._rank_memories(query, limit)
+
+        try:
+            version = int(_redis_client.get(self._version_key()) or 0)
+            query_hash = hashlib.blake2b(query.encode('utf-8'), digest_size=8).hexdigest()
+            cache_key = f"mem:{self.user_id}:{version}:{limit}:{query_hash}"
+            cached = _redis_client.get(cache_key)
+        except redis.RedisError as e:
+            logging.warning(f"Memory cache lookup failed: {e}")
+            return self._rank_memories(query, limit)
+
+        if cached is not None:
+            # Rebuild transient rows; callers only read their attributes
+            return [UserMemory(**fields) for fields in json.loads(cached)]
+
+        memories = self._rank_memories(query, limit)
+        try:
+            payload = [{field: getattr(m, field) for field in _CACHED_MEMORY_FIELDS} for m in memories]
+            _redis_client.setex(cache_key, MEMORY_CACHE_TTL_SECONDS, json.dumps(payload))
+        except redis.RedisError as e:
+            logging.warning(f"Memory cache store failed: {e}")
+        return memories
+
+    def _rank_memories(self, query, limit):
+        global _trigram_search_available
+        if _trigram_search_available and db.engine.dialect.name == 'postgresql':
+            try:
+                return UserMemory.search(self.user_id, query, limit)
+            except DBAPIError as e:
+                db.session.rollback()
+                if getattr(e.orig, 'pgcode', None) == UNDEFINED_FUNCTION_PGCODE:
+                    logging.warning(f"Trigram memory search unavailable, ranking with TF-IDF: {e}")
+                    _trigram_search_available = False
+                else:
+                    logging.warning(f"Trigram memory search failed, ranking with TF-IDF: {e}")
+
+        memories = UserMemory.most_important(self.user_id, MEMORY_CANDIDATE_LIMIT)
 
         if not memories:
             return []
 
         if not SKLEARN_AVAILABLE:
-            # Fallback to recent memories if sklearn not available
-            return UserMemory.query.filter_by(user_id=self.user_id) \
-                .order_by(UserMemory.last_accessed.desc()).limit(limit).all()
+            # Fallback to the most important memories if sklearn not available
+            return memories[:limit]
 
         # Create text corpus from memories
         memory_texts = [f"{m.key} {m.value}" for m in memories]
@@ -49,26 +126,26 @@ class MemoryManager:
 
         # Calculate similarity
         try:
-            tfidf_matrix = self.vectorizer.fit_transform(memory_texts)
+            # A fresh vectorizer per call keeps a cached manager safe to share between concurrent requests
+            vectorizer = TfidfVectorizer(max_features=100, stop_words='english')
+            tfidf_matrix = vectorizer.fit_transform(memory_texts)
             query_vector = tfidf_matrix[-1]
             memory_vectors = tfidf_matrix[:-1]
 
-            similarities = cosine_similarity(query_vector, memory_vectors).flatten()
+            # TF-IDF rows are already L2-normalised, so a plain dot product gives the cosine similarity
+            similarities = linear_kernel(query_vector, memory_vectors).ravel()
 
-            # Get top memories with importance weighting
-            scored_memories = []
-            for i, memory in enumerate(memories):
-                score = similarities[i] * memory.importance_score
-                scored_memories.append((memory, score))
+            # Weight every memory by importance in one vectorised pass
+            importance = np.fromiter((m.importance_score for m in memories), dtype=float, count=len(memories))
+            scores = similarities * importance
 
-            # Sort by score and return top results
-            scored_memories.sort(key=lambda x: x[1], reverse=True)
-            return [mem[0] for mem in scored_memories[:limit]]
+            # Stable sort keeps the importance order among equal scores
+            top_indices = np.argsort(-scores, kind='stable')[:limit]
+            return [memories[i] for i in top_indices]
 
         except Exception as e:
-            # Fallback to recent memories
-            return UserMemory.query.filter_by(user_id=self.user_id) \
-                .order_by(UserMemory.last_accessed.desc()).limit(limit).all()
+            # Fallback to the most important memories
+            return memories[:limit]
 
     def update_memory_importance(self, memory_id, interaction_type='access'):
         """Update memory importance based on usage"""
@@ -80,3 +157,4 @@ class MemoryManager:
                 memory.importance_score *= 1.3
             memory.last_accessed = datetime.utcnow()
             db.session.commit()
+            self.invalidate_cache()
@@ -1,10 +1,36 @@
 from datetime import datetime, timedelta
 from flask import current_app
+from sqlalchemy import case, func
 from models import db, Message, Conversation, ProactiveTask
 import json
 import re
 
 
+def _keyword_pattern(keywords):
+    # One case-insensitive pass over the original text instead of lowering it and scanning once per keyword
+    return re.compile('|'.join(map(re.escape, keywords)), re.IGNORECASE)
+
+
+CODING_KEYWORDS = _keyword_pattern(['code', 'programming', 'debug', 'error', 'function', 'class', 'variable'])
+DEBUG_KEYWORDS = _keyword_pattern(['error', 'bug'])
+OPTIMIZATION_KEYWORDS = _keyword_pattern(['optimize', 'improve'])
+DEADLINE_KEYWORDS = _keyword_pattern(['deadline', 'due date', 'submit by', 'finish by', 'complete by'])
+LEARNING_KEYWORDS = _keyword_pattern(['learn', 'tutorial', 'how to', 'explain', 'understand', 'guide'])
+LEARNING_TOPICS = {
+    'python': _keyword_pattern(['python', 'django', 'flask', 'pandas']),
+    'javascript': _keyword_pattern(['javascript', 'js', 'react', 'node']),
+    'web': _keyword_pattern(['html', 'css', 'web development', 'frontend']),
+    'data': _keyword_pattern(['data science', 'machine learning', 'ai', 'analytics']),
+    'database': _keyword_pattern(['sql', 'database', 'mysql', 'postgresql'])
+}
+# MM/DD/YYYY or MM-DD-YYYY, "12 march 2025", or a relative day
+DATE_MENTION = re.compile(
+    r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b'
+    r'|\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\w*\s+\d{2,4}\b'
+    r'|\b(?:today|tomorrow|next week|this week)\b',
+    re.IGNORECASE)
+
+
 class ProactiveAssistant:
     def __init__(self, user_id):
         self.user_id = user_id
@@ -13,12 +39,11 @@ class ProactiveAssistant:
 
     def analyze_coding_patterns(self, current_message):
         """Analyze coding-related queries and suggest improvements"""
-        coding_keywords = ['code', 'programming', 'debug', 'error', 'function', 'class', 'variable']
         suggestions = []
 
-        if any(keyword in current_message.lower() for keyword in coding_keywords):
+        if CODING_KEYWORDS.search(current_message):
             # Check for common coding issues
-            if 'error' in current_message.lower() or 'bug' in current_message.lower():
+            if DEBUG_KEYWORDS.search(current_message):
                 suggestions.append({
                     'type': 'debug_assistance',
                     'message': "I notice you're dealing with an error. Would you like me to help debug this step by step?",
@@ -26,7 +51,7 @@ class ProactiveAssistant:
                     'priority': 'high'
                 })
 
-            if 'optimize' in current_message.lower() or 'improve' in current_message.lower():
+            if OPTIMIZATION_KEYWORDS.search(current_message):
                 suggestions.append({
                     'type': 'code_optimization',
                     'message': "I can help optimize your code for better performance and readability!",
@@ -36,15 +61,23 @@ class ProactiveAssistant:
 
         return suggestions
 
-    def check_work_session_duration(self):
+    def count_recent_messages(self, now=None):
+        """Count the user's messages from the last hour, two hours and day in one aggregate query"""
+        now = now or datetime.utcnow()
+        return db.session.query(
+            func.count(case((Message.created_at >= now - timedelta(hours=1), Message.id))),
+            func.count(case((Message.created_at >= now - timedelta(hours=2), Message.id))),
+            func.count(Message.id)
+        ).select_from(Message).join(Conversation).filter(
+            Conversation.user_id == self.user_id,
+            Message.created_at >= now - timedelta(days=1)
+        ).one()
+
+    def check_work_session_duration(self, now=None, message_counts=None):
         """Check if user needs a break reminder"""
         try:
-            # Check recent conversation activity
-            two_hours_ago = datetime.utcnow() - timedelta(hours=2)
-            recent_messages = Message.query.join(Conversation).filter(
-                Conversation.user_id == self.user_id,
-                Message.created_at >= two_hours_ago
-            ).count()
+            # Check recent conversation activity over the last two hours
+            recent_messages = (message_counts or self.count_recent_messages(now))[1]
 
             if recent_messages > self.work_session_threshold:
                 return {
@@ -58,39 +91,27 @@ class ProactiveAssistant:
 
         return None
 
-    def check_upcoming_deadlines(self):
+    def check_upcoming_deadlines(self, now=None):
         """Check for upcoming deadlines mentioned in conversations"""
         try:
             # Search for deadline-related keywords in recent messages
-            deadline_keywords = ['deadline', 'due date', 'submit by', 'finish by', 'complete by']
             suggestions = []
 
             # Look for messages containing deadline information
             recent_messages = Message.query.join(Conversation).filter(
                 Conversation.user_id == self.user_id,
-                Message.created_at >= datetime.utcnow() - timedelta(days=7)
+                Message.created_at >= (now or datetime.utcnow()) - timedelta(days=7)
             ).all()
 
             for message in recent_messages:
-                content_lower = message.content.lower()
-                if any(keyword in content_lower for keyword in deadline_keywords):
-                    # Extract potential dates using regex
-                    date_patterns = [
-                        r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b',  # MM/DD/YYYY or MM-DD-YYYY
-                        r'\b\d{1,2}\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\w*\s+\d{2,4}\b',
-                        r'\b(today|tomorrow|next week|this week)\b'
-                    ]
-
-                    for pattern in date_patterns:
-                        matches = re.findall(pattern, content_lower, re.IGNORECASE)
-                        if matches:
-                            suggestions.append({
-                                'type': 'deadline_alert',
-                                'message': f"Reminder: You mentioned a deadline - '{message.content[:100]}...'",
-                                'context': message.content,
-                                'priority': 'high'
-                            })
-                            break
+                # Only messages that mention both a deadline and a date are surfaced
+                if DEADLINE_KEYWORDS.search(message.content) and DATE_MENTION.search(message.content):
+                    suggestions.append({
+                        'type': 'deadline_alert',
+                        'message': f"Reminder: You mentioned a deadline - '{message.content[:100]}...'",
+                        'context': message.content,
+                        'priority': 'high'
+                    })
 
             return suggestions[:3]  # Limit to 3 most recent
         except Exception as e:
@@ -99,22 +120,13 @@ class ProactiveAssistant:
 
     def suggest_learning_resources(self, current_message):
         """Suggest learning resources based on user queries"""
-        learning_keywords = ['learn', 'tutorial', 'how to', 'explain', 'understand', 'guide']
         suggestions = []
 
-        if any(keyword in current_message.lower() for keyword in learning_keywords):
+        if LEARNING_KEYWORDS.search(current_message):
             # Identify the topic
-            topics = {
-                'python': ['python', 'django', 'flask', 'pandas'],
-                'javascript': ['javascript', 'js', 'react', 'node'],
-                'web': ['html', 'css', 'web development', 'frontend'],
-                'data': ['data science', 'machine learning', 'ai', 'analytics'],
-                'database': ['sql', 'database', 'mysql', 'postgresql']
-            }
-
             detected_topic = None
-            for topic, keywords in topics.items():
-                if any(keyword in current_message.lower() for keyword in keywords):
+            for topic, keywords in LEARNING_TOPICS.items():
+                if keywords.search(current_message):
                     detected_topic = topic
                     break
 
@@ -129,25 +141,14 @@ class ProactiveAssistant:
 
         return suggestions
 
-    def check_productivity_patterns(self):
+    def check_productivity_patterns(self, now=None, message_counts=None):
         """Analyze productivity patterns and suggest improvements"""
         try:
             suggestions = []
 
             # Check message frequency patterns
-            now = datetime.utcnow()  # Use utcnow() for consistency
-            last_hour = now - timedelta(hours=1)
-            last_day = now - timedelta(days=1)
-
-            recent_messages = Message.query.join(Conversation).filter(
-                Conversation.user_id == self.user_id,
-                Message.created_at >= last_hour
-            ).count()
-
-            daily_messages = Message.query.join(Conversation).filter(
-                Conversation.user_id == self.user_id,
-                Message.created_at >= last_day
-            ).count()
+            now = now or datetime.utcnow()  # Use utcnow() for consistency
+            recent_messages, _, daily_messages = message_counts or self.count_recent_messages(now)
 
             # High activity suggestion
             if recent_messages > 15:
@@ -172,7 +173,7 @@ class ProactiveAssistant:
             current_app.logger.error(f"Error checking productivity patterns: {e}")
             return []
 
-    def generate_contextual_suggestions(self, current_message, emotion_data=None):
+    def generate_contextual_suggestions(self, current_message, emotion_data=None, now=None):
         """Generate contextual suggestions based on current message and emotions"""
         suggestions = []
 
@@ -195,7 +196,7 @@ class ProactiveAssistant:
                 })
 
         # Time-based suggestions (use utcnow() for consistency)
-        current_hour = datetime.utcnow().hour
+        current_hour = (now or datetime.utcnow()).hour
         if 9 <= current_hour <= 11:  # Morning
             suggestions.append({
                 'type': 'morning_productivity',
@@ -220,14 +221,26 @@ class ProactiveAssistant:
 
         current_message = context.get('current_message', '')
         emotions = context.get('emotions', {})
+        # Read the clock once and share it across every time-window check
+        now = datetime.utcnow()
 
         try:
+            # The break and productivity checks share one query over the last day's messages. It runs in a
+            # savepoint: on PostgreSQL a failed statement aborts the whole transaction, which would sink the
+            # per-check fallback queries and the chat rows already staged on the session.
+            try:
+                with db.session.begin_nested():
+                    message_counts = self.count_recent_messages(now)
+            except Exception as e:
+                current_app.logger.error(f"Error counting recent messages: {e}")
+                message_counts = None
+
             # Check various proactive scenarios
-            break_suggestion = self.check_work_session_duration()
+            break_suggestion = self.check_work_session_duration(now, message_counts)
             if break_suggestion:
                 all_suggestions.append(break_suggestion)
 
-            deadline_suggestions = self.check_upcoming_deadlines()
+            deadline_suggestions = self.check_upcoming_deadlines(now)
             all_suggestions.extend(deadline_suggestions)
 
             coding_suggestions = self.analyze_coding_patterns(current_message)
@@ -236,10 +249,10 @@ class ProactiveAssistant:
             learning_suggestions = self.suggest_learning_resources(current_message)
             all_suggestions.extend(learning_suggestions)
 
-            productivity_suggestions = self.check_productivity_patterns()
+            productivity_suggestions = self.check_productivity_patterns(now, message_counts)
             all_suggestions.extend(productivity_suggestions)
 
-            contextual_suggestions = self.generate_contextual_suggestions(current_message, emotions)
+            contextual_suggestions = self.generate_contextual_suggestions(current_message, emotions, now)
             all_suggestions.extend(contextual_suggestions)
 
             # Sort by priority and limit results
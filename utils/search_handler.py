@@ -1,25 +1,34 @@
+import logging
 import os
-from serpapi import GoogleSearch
+import requests
+from requests.adapters import HTTPAdapter
+from utils.analysis_handler import classify_prompt, PROMPT_REALTIME
 
-REALTIME_KEYWORDS = [
-    "weather", "price", "cost", "stock", "temperature", "temp", "news",
-    "latest", "current", "how much", "what is the time", "capital of"
-]
+SERPAPI_SEARCH_URL = "https://serpapi.com/search"
+SERPAPI_TIMEOUT = 5.0
+
+# Shared session so realtime lookups reuse pooled keep-alive connections instead of a new TLS handshake each time
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
 
 
 def is_realtime_query(text: str) -> bool:
-    return any(keyword in text.lower() for keyword in REALTIME_KEYWORDS)
+    return bool(classify_prompt(text) & PROMPT_REALTIME)
 
 
 def fetch_realtime_info(query: str) -> str:
-    print(f"-> EXECUTING MANUAL SEARCH for: '{query}'")
+    logging.info(f"Executing realtime search for: '{query}'")
     try:
         api_key = os.getenv("SERPAPI_API_KEY")
         if not api_key:
             return "Error: SERPAPI_API_KEY is not set."
-        params = {"q": query, "api_key": api_key, "engine": "google", "hl": "en"}
-        search = GoogleSearch(params)
-        results = search.get_dict()
+        params = {"q": query, "api_key": api_key, "engine": "google", "hl": "en", "output": "json"}
+        response = _http_session.get(SERPAPI_SEARCH_URL, params=params, timeout=SERPAPI_TIMEOUT)
+        if not response.ok:
+            # Quota (429) and auth (401) errors come back as JSON bodies that must not be read as results
+            logging.warning(f"Realtime search failed with HTTP {response.status_code}")
+            return "No definitive real-time information found."
+        results = response.json()
         if "answer_box" in results and "answer" in results["answer_box"]:
             return results["answer_box"]["answer"]
         if "organic_results" in results and results["organic_results"] and "snippet" in results["organic_results"][0]: